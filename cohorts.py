@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+# Через сколько лет после года когорты считается возвращение студентов
+RETENTION_OFFSETS = (1, 2)
+
+
+def build_activity_matrix(activity):
+    """Строит матрицы активности студент × год по строкам storage.query_student_activity.
+
+    Возвращает словарь: 'years' - встречающиеся годы по возрастанию, по одному
+    столбцу на год, поэтому опечатка в годе добавляет один столбец, а не тысячи;
+    'Все', 'Курс', 'Соревнование' и 'Призер' - булевы матрицы участия студента
+    в мероприятиях этого типа в этом году"""
+    student_codes, students = pd.factorize(activity['id_студента'])
+    years, year_codes = np.unique(activity['Год'].astype(int).to_numpy(), return_inverse=True)
+
+    shape = (len(students), len(years))
+    matrix = {'years': years}
+    for name, mask in [
+        ('Все', np.ones(len(activity), dtype=bool)),
+        ('Курс', (activity['Тип мероприятия'] == 'Курс').to_numpy()),
+        ('Соревнование', (activity['Тип мероприятия'] == 'Соревнование').to_numpy()),
+        ('Призер', (activity['Призер'] == 1).to_numpy()),
+    ]:
+        matrix[name] = np.zeros(shape, dtype=bool)
+        matrix[name][student_codes[mask], year_codes[mask]] = True
+    return matrix
+
+
+def shifted_columns(years, offset):
+    """Для каждого года - столбец года Y+offset или -1, если такого года в данных нет"""
+    positions = np.searchsorted(years, years + offset)
+    found = positions < len(years)
+    found[found] = years[positions[found]] == years[found] + offset
+    return np.where(found, positions, -1)
+
+
+def from_year_on(activity):
+    """Отмечает для каждого года, будет ли активность в этом году или позже"""
+    return np.logical_or.accumulate(activity[:, ::-1], axis=1)[:, ::-1]
+
+
+def cohort_year_mask(years, cohort_years):
+    """Столбцы годов, которые выбраны как годы когорт; None - все годы"""
+    if cohort_years is None:
+        return np.ones(len(years), dtype=bool)
+    return np.isin(years, cohort_years)
+
+
+def retention_table(matrix, cohort_type, cohort_years=None):
+    """Удержание и переход к соревнованиям по когортам.
+
+    Когорта года Y - студенты, участвовавшие в мероприятиях типа cohort_type
+    ('Все', 'Курс' или 'Соревнование') в году Y. Возвращение через k лет -
+    участие в любом мероприятии в году Y+k, для лет за пределами данных
+    значение неизвестно. Переход - участие в соревновании в году Y или позже"""
+    years = matrix['years']
+    cohort = matrix[cohort_type]
+    active = matrix['Все']
+
+    table = pd.DataFrame({'Год': years, 'Размер когорты': cohort.sum(axis=0)})
+    for offset in RETENTION_OFFSETS:
+        # Год Y+offset позже последнего года данных - возвращение неизвестно,
+        # год внутри данных, но без мероприятий - не вернулся никто
+        returned = np.where(years + offset <= years.max(initial=0), 0, np.nan)
+        columns = shifted_columns(years, offset)
+        found = columns >= 0
+        returned[found] = (cohort[:, found] & active[:, columns[found]]).sum(axis=0)
+        table[f'Вернулись через {offset} г.'] = pd.array(returned, dtype='Int64')
+    table['Перешли к соревнованиям'] = (cohort & from_year_on(matrix['Соревнование'])).sum(axis=0)
+
+    table = table[cohort_year_mask(years, cohort_years) & (table['Размер когорты'] > 0)].reset_index(drop=True)
+    for column in table.columns[2:]:
+        table[f'% {column}'] = (table[column] / table['Размер когорты'] * 100).round(1)
+    return table
+
+
+def funnel_table(matrix, cohort_type, cohort_years=None):
+    """Воронка студентов выбранных когорт: каждый этап включает только прошедших предыдущий"""
+    year_mask = cohort_year_mask(matrix['years'], cohort_years)
+    cohort = matrix[cohort_type] & year_mask
+    active = matrix['Все']
+
+    next_columns = shifted_columns(matrix['years'], 1)
+    has_next = next_columns >= 0
+    stages = {
+        'В когорте': cohort.any(axis=1),
+        'Вернулись на следующий год': (cohort[:, has_next] & active[:, next_columns[has_next]]).any(axis=1),
+        'Участвовали в соревнованиях': (cohort & from_year_on(matrix['Соревнование'])).any(axis=1),
+        'Стали победителями или призерами': (cohort & from_year_on(matrix['Призер'])).any(axis=1),
+    }
+    counts = np.logical_and.accumulate(np.array(list(stages.values())), axis=0).sum(axis=1)
+
+    table = pd.DataFrame({'Этап': list(stages), 'Количество студентов': counts})
+    total = max(counts[0], 1)
+    previous = np.maximum(np.concatenate([[counts[0]], counts[:-1]]), 1)
+    table['% от когорты'] = (table['Количество студентов'] / total * 100).round(1)
+    table['% от предыдущего этапа'] = (table['Количество студентов'] / previous * 100).round(1)
+    return table
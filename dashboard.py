@@ -1,13 +1,13 @@
 import streamlit as st
-import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from datetime import datetime
-import os
+import math
 from pathlib import Path
 from auth import check_password
-import re
 import yaml
+import storage
+import cohorts
+from data_watcher import start_watcher, WATCH_INTERVAL
 
 # Настройка страницы
 st.set_page_config(page_title="Анализ образовательных программ", layout="wide")
@@ -27,348 +27,410 @@ def load_config():
     with open(config_path, 'r') as f:
         return yaml.safe_load(f)
 
-# Функция для загрузки последних данных
-def load_latest_data():
-    # Находим последние файлы с данными
-    files = [f for f in os.listdir('.') if f.startswith(('students_clean_', 'events_clean_', 'student_event_relations_'))]
-    if not files:
-        st.error("Файлы с данными не найдены. Пожалуйста, сначала запустите main.py")
-        return None, None, None
+# Фоновая проверка новых наборов данных, одна на процесс и общая для всех сессий
+@st.cache_resource(show_spinner="Подготовка данных...")
+def get_dataset_watcher(data_path, interval):
+    return start_watcher(data_path, interval)
+
+# Максимальное количество студентов в списке выбора
+STUDENT_LIST_LIMIT = 1000
+
+# Количество повторяющихся мероприятий на одной странице графика
+RECURRING_EVENTS_PER_PAGE = 10
+
+# Количество строк на одной странице таблицы
+TABLE_PAGE_SIZE = 100
+
+def show_table_page(df, key):
+    """Показывает таблицу постранично, в браузер отправляется только текущая страница"""
+    pages = max(1, math.ceil(len(df) / TABLE_PAGE_SIZE))
+    page = 1
+    if pages > 1:
+        page = st.number_input(f"Страница (всего {pages})", min_value=1, max_value=pages, value=1, key=key)
+    st.dataframe(
+        df.iloc[(page - 1) * TABLE_PAGE_SIZE:page * TABLE_PAGE_SIZE],
+        use_container_width=True
+    )
+    if pages > 1:
+        st.caption(f"Всего строк: {len(df)}")
+
+# Сколько результатов хранит в памяти каждая кэшируемая функция: ключи включают
+# строку поиска, фильтры и версию базы, поэтому без предела кэш растет без конца
+CACHE_MAX_ENTRIES = 100
+
+# Матрицы активности крупнее остальных результатов, их храним меньше
+ACTIVITY_CACHE_MAX_ENTRIES = 10
+
+# Кэшируем результаты запросов до следующего обновления базы
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def get_filter_values(db_path, db_version):
+    return storage.load_filter_values(db_path)
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def get_event_participants(db_path, db_version, event_type, years):
+    return storage.query_event_participants(db_path, event_type, years)
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def get_students(db_path, db_version, search, regions, cities):
+    return storage.search_students(db_path, search, regions, cities, STUDENT_LIST_LIMIT)
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def get_student_events(db_path, db_version, student_id):
+    return storage.query_student_events(db_path, student_id)
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def get_course_competition_pairs(db_path, db_version):
+    return (
+        storage.query_pairs_by_year(db_path),
+        storage.query_popular_pairs(db_path),
+        storage.query_course_effectiveness(db_path),
+    )
+
+# Матрица активности строится один раз для набора данных и фильтров по студентам
+@st.cache_data(show_spinner=False, max_entries=ACTIVITY_CACHE_MAX_ENTRIES)
+def get_activity_matrix(db_path, db_version, regions, cities):
+    return cohorts.build_activity_matrix(storage.query_student_activity(db_path, regions, cities))
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES)
+def get_cohort_tables(db_path, db_version, event_type, years, regions, cities):
+    matrix = get_activity_matrix(db_path, db_version, regions, cities)
+    return (
+        cohorts.retention_table(matrix, event_type, years),
+        cohorts.funnel_table(matrix, event_type, years),
+    )
+
+def show_event_analysis(db_path, db_version, event_type, year_filter):
+    """Раздел «Анализ мероприятий»"""
+    st.header("Анализ мероприятий")
     
-    # Получаем временные метки из имен файлов
-    timestamps = set()
-    for file in files:
-        if '_' in file:
-            timestamp = file.split('_')[-1].replace('.xlsx', '')
-            timestamps.add(timestamp)
+    # Подсчет участников для каждого мероприятия
+    event_participants = get_event_participants(db_path, db_version, event_type, year_filter)
     
-    if not timestamps:
-        st.error("Не удалось найти файлы с данными")
-        return None, None, None
+    # Сортировка мероприятий
+    sort_by = st.selectbox(
+        "Сортировка",
+        ["По количеству участников (по убыванию)", "По количеству участников (по возрастанию)", "По году (по убыванию)", "По году (по возрастанию)"],
+        key="sort_by"
+    )
+    
+    if "по убыванию" in sort_by:
+        ascending = False
+    else:
+        ascending = True
+        
+    if "количеству участников" in sort_by:
+        event_participants = event_participants.sort_values('Количество участников', ascending=ascending)
+    else:
+        event_participants = event_participants.sort_values('Год', ascending=ascending)
+    
+    # Отображение таблицы мероприятий
+    show_table_page(
+        event_participants[['Мероприятие', 'Тип мероприятия', 'Год', 'Количество участников']],
+        key="events_page"
+    )
+    
+    # График количества участников по мероприятиям
+    fig = px.bar(
+        event_participants,
+        x='Мероприятие',
+        y='Количество участников',
+        color='Тип мероприятия',
+        title='Количество участников по мероприятиям'
+    )
+    st.plotly_chart(fig, use_container_width=True)
+    
+    # Анализ повторяющихся мероприятий
+    st.subheader("Повторяющиеся мероприятия")
+    recurring_events = event_participants.groupby('Мероприятие').agg(**{
+        'Количество проведений': ('Год', 'size'),
+        'Всего участников': ('Количество участников', 'sum')
+    }).reset_index()
+    recurring_events = recurring_events[recurring_events['Количество проведений'] > 1]
+    recurring_events = recurring_events.sort_values('Всего участников', ascending=False)
     
-    # Берем последнюю временную метку
-    latest_timestamp = max(timestamps)
+    if not recurring_events.empty:
+        # Один общий график динамики вместо отдельного графика на каждое мероприятие,
+        # мероприятия выводятся постранично, чтобы размер страницы не зависел от их числа.
+        # Таблица и график показывают одну и ту же страницу мероприятий
+        pages = math.ceil(len(recurring_events) / RECURRING_EVENTS_PER_PAGE)
+        page = 1
+        if pages > 1:
+            page = st.number_input(f"Страница (всего {pages})", min_value=1, max_value=pages, value=1,
+                                   key="recurring_page")
+        page_recurring_events = recurring_events.iloc[
+            (page - 1) * RECURRING_EVENTS_PER_PAGE:page * RECURRING_EVENTS_PER_PAGE
+        ]
+        page_events = page_recurring_events['Мероприятие']
+        
+        st.dataframe(page_recurring_events, use_container_width=True)
+        if pages > 1:
+            st.caption(f"Всего повторяющихся мероприятий: {len(recurring_events)}")
+        
+        event_data = event_participants[event_participants['Мероприятие'].isin(page_events)]
+        event_data = event_data.groupby(['Мероприятие', 'Год'], as_index=False)['Количество участников'].sum()
+        # Сортируем данные по году
+        event_data = event_data.sort_values('Год')
+        fig = px.line(
+            event_data,
+            x='Год',
+            y='Количество участников',
+            color='Мероприятие',
+            markers=True,
+            title=f'Динамика участников повторяющихся мероприятий (страница {page} из {pages})'
+        )
+        # Добавляем настройку оси Y
+        fig.update_layout(
+            yaxis=dict(
+                range=[0, event_data['Количество участников'].max() * 1.1]  # Добавляем 10% отступа сверху
+            )
+        )
+        st.plotly_chart(fig, use_container_width=True)
+
+def show_student_track(db_path, db_version, region_filter, city_filter):
+    """Раздел «Трек студента»"""
+    st.header("Трек студента")
     
-    # Загружаем данные
-    students_df = pd.read_excel(f'students_clean_20250530_011651.xlsx')
-    events_df = pd.read_excel(f'events_clean_20250530_011651.xlsx')
-    relations_df = pd.read_excel(f'student_event_relations_20250530_011651.xlsx')
+    # Выбор студента
+    student_search = st.text_input("Поиск студента (ФИО или телефон)", key="student_search")
     
-    return students_df, events_df, relations_df
+    # Поиск по ФИО или телефону, без поиска - студенты по фильтрам
+    filtered_students = get_students(db_path, db_version, student_search, region_filter, city_filter)
+    
+    if len(filtered_students) == STUDENT_LIST_LIMIT:
+        st.caption(f"Показаны первые {STUDENT_LIST_LIMIT} студентов, уточните поиск")
+    
+    if not filtered_students.empty:
+        selected_student = st.selectbox(
+            "Выберите студента",
+            filtered_students['ФИО'].tolist(),
+            key="selected_student"
+        )
+        
+        if selected_student:
+            student_id = filtered_students[filtered_students['ФИО'] == selected_student]['id'].iloc[0]
+            
+            # Получаем мероприятия студента
+            student_events = get_student_events(db_path, db_version, student_id)
+            
+            # Отображаем информацию о студенте
+            student_info = filtered_students[filtered_students['id'] == student_id].iloc[0]
+            st.subheader("Информация о студенте")
+            st.write(f"ФИО: {student_info['ФИО']}")
+            st.write(f"Регион: {student_info['РЕГИОН']}")
+            st.write(f"Город: {student_info['ГОРОД']}")
+            st.write(f"Школа: {student_info['ШКОЛА']}")
+            
+            # Отображаем мероприятия студента
+            st.subheader("Мероприятия студента")
+            st.dataframe(
+                student_events[['Мероприятие', 'Тип мероприятия', 'Год']],
+                use_container_width=True
+            )
+            
+            # Визуализация трека студента
+            fig = go.Figure()
+            
+            # Добавляем курсы
+            courses = student_events[student_events['Тип мероприятия'] == 'Курс']
+            fig.add_trace(go.Scatter(
+                x=courses['Год'],
+                y=[1] * len(courses),
+                mode='markers+text',
+                name='Курсы',
+                text=courses['Мероприятие'],
+                textposition="top center",
+                marker=dict(size=10, symbol='circle')
+            ))
+            
+            # Добавляем соревнования
+            competitions = student_events[student_events['Тип мероприятия'] == 'Соревнование']
+            fig.add_trace(go.Scatter(
+                x=competitions['Год'],
+                y=[2] * len(competitions),
+                mode='markers+text',
+                name='Соревнования',
+                text=competitions['Мероприятие'],
+                textposition="top center",
+                marker=dict(size=10, symbol='star')
+            ))
+            
+            fig.update_layout(
+                title='Трек студента',
+                yaxis=dict(
+                    showticklabels=False,
+                    range=[0, 3]
+                ),
+                showlegend=True
+            )
+            
+            st.plotly_chart(fig, use_container_width=True)
+
+def show_effectiveness(db_path, db_version):
+    """Раздел «Анализ эффективности»"""
+    st.header("Анализ эффективности")
+    
+    # Анализ связи между курсами и соревнованиями
+    st.subheader("Связь между курсами и соревнованиями")
+    
+    # Получаем все пары курс-соревнование и статистику мест по ним
+    pairs_by_year, popular_pairs, course_effectiveness = get_course_competition_pairs(db_path, db_version)
+    
+    if not pairs_by_year.empty:
+        st.write("Популярные пары курс-соревнование:")
+        show_table_page(popular_pairs[['Курс', 'Соревнование', 'Количество студентов', 'Победители', 'Призеры', 'Не заняли места']],
+                        key="pairs_page")
+        
+        # Визуализация связей с учетом мест: пары объединены по курсу и годам,
+        # размер точки - количество пар, поэтому число точек не растет вместе с данными
+        fig = px.scatter(
+            pairs_by_year,
+            x='Год курса',
+            y='Год соревнования',
+            color='Курс',
+            size='Количество студентов',
+            hover_data=['Количество студентов', 'Победители', 'Призеры', 'Не заняли места'],
+            title='Связь между курсами и соревнованиями по годам'
+        )
+        st.plotly_chart(fig, use_container_width=True)
+        
+        # Анализ эффективности курсов
+        st.subheader("Эффективность курсов")
+        
+        # Добавляем процентные показатели
+        course_effectiveness['% Победителей'] = (course_effectiveness['Победители'] / course_effectiveness['Количество студентов'] * 100).round(1)
+        course_effectiveness['% Призеров'] = (course_effectiveness['Призеры'] / course_effectiveness['Количество студентов'] * 100).round(1)
+        course_effectiveness['% Не заняли места'] = (course_effectiveness['Не заняли места'] / course_effectiveness['Количество студентов'] * 100).round(1)
+        
+        # Сортируем по проценту победителей и призеров
+        course_effectiveness = course_effectiveness.sort_values(['% Победителей', '% Призеров'], ascending=False)
+        
+        st.write("Эффективность курсов (по количеству и проценту победителей и призеров):")
+        st.dataframe(course_effectiveness[[
+            'Курс', 'Количество студентов', 
+            'Победители', '% Победителей',
+            'Призеры', '% Призеров',
+            'Не заняли места', '% Не заняли места'
+        ]], use_container_width=True)
+        
+        # Визуализация эффективности курсов
+        fig = px.bar(
+            course_effectiveness,
+            x='Курс',
+            y=['% Победителей', '% Призеров', '% Не заняли места'],
+            title='Эффективность курсов (в процентах)',
+            barmode='group',
+            labels={'value': 'Процент студентов', 'variable': 'Категория'}
+        )
+        st.plotly_chart(fig, use_container_width=True)
+        
+    else:
+        st.write("Не найдено связей между курсами и соревнованиями")
+
+def show_cohorts(db_path, db_version, event_type, year_filter, region_filter, city_filter):
+    """Раздел «Когорты и удержание»"""
+    st.header("Когорты и удержание")
+
+    # Когорта года - участники мероприятий выбранного в фильтре типа в этом году
+    retention, funnel = get_cohort_tables(db_path, db_version, event_type, year_filter, region_filter, city_filter)
+
+    if retention.empty:
+        st.write("Нет студентов, подходящих под фильтры")
+        return
+
+    retention_columns = ['Вернулись через 1 г.', 'Вернулись через 2 г.', 'Перешли к соревнованиям']
+    if event_type == "Соревнование":
+        # Участники соревнований по определению уже перешли к соревнованиям
+        retention_columns = retention_columns[:2]
+
+    st.subheader("Удержание по годам")
+    st.caption("Возвращение - участие в любом мероприятии через 1 или 2 года, "
+               "переход - участие в соревновании в том же году или позже")
+    st.dataframe(
+        retention[['Год', 'Размер когорты']
+                  + [column for name in retention_columns for column in (name, f'% {name}')]],
+        use_container_width=True
+    )
+
+    fig = px.line(
+        retention,
+        x='Год',
+        y=[f'% {name}' for name in retention_columns],
+        markers=True,
+        title='Удержание когорт (в процентах)',
+        labels={'value': 'Процент студентов когорты', 'variable': 'Показатель', 'Год': 'Год когорты'}
+    )
+    fig.update_layout(yaxis=dict(range=[0, 105]))
+    st.plotly_chart(fig, use_container_width=True)
 
-# Загружаем данные
-students_df, events_df, relations_df = load_latest_data()
+    st.subheader("Воронка")
+    st.dataframe(funnel, use_container_width=True)
+    fig = px.funnel(funnel, x='Количество студентов', y='Этап', title='Воронка студентов выбранных когорт')
+    st.plotly_chart(fig, use_container_width=True)
 
-if students_df is not None and events_df is not None and relations_df is not None:
+
+# Подключаемся к данным
+config = load_config() or {}
+watcher = get_dataset_watcher(
+    config.get('data_path', '.'),
+    config.get('watch_interval', WATCH_INTERVAL)
+)
+
+# Текущий набор данных берем один раз за перезапуск: если в это время
+# подготовят новый набор, он будет использован со следующего перезапуска
+current_dataset = watcher['current']
+
+if current_dataset is None:
+    st.error("Файлы с данными не найдены. Пожалуйста, сначала запустите main.py")
+else:
+    db_path, db_version = current_dataset
+    years, regions, cities = get_filter_values(db_path, db_version)
+    
     # Создаем боковую панель с фильтрами
     st.sidebar.title("Фильтры")
     
     # Фильтр по типу мероприятия
     event_type = st.sidebar.selectbox(
         "Тип мероприятия",
-        ["Все", "Курс", "Соревнование"]
+        ["Все", "Курс", "Соревнование"],
+        key="event_type"
     )
     
     # Фильтр по году
-    years = sorted(events_df['Год'].unique())
     selected_years = st.sidebar.multiselect(
         "Год",
         years,
-        default=years
+        default=years,
+        key="years"
     )
     
     # Фильтр по региону
-    regions = sorted(students_df['РЕГИОН'].dropna().unique())
     selected_regions = st.sidebar.multiselect(
         "Регион",
         regions,
-        default=regions
+        default=regions,
+        key="regions"
     )
     
     # Фильтр по городу
-    cities = sorted(students_df['ГОРОД'].dropna().unique())
     selected_cities = st.sidebar.multiselect(
         "Город",
         cities,
-        default=cities
+        default=cities,
+        key="cities"
     )
     
-    # Применяем фильтры
-    filtered_events = events_df[
-        (event_type == "Все" or events_df['Тип мероприятия'] == event_type) &
-        (events_df['Год'].isin(selected_years))
-    ]
+    # Если выбраны все значения, фильтр в запрос не передаем
+    year_filter = None if len(selected_years) == len(years) else selected_years
+    region_filter = None if len(selected_regions) == len(regions) else selected_regions
+    city_filter = None if len(selected_cities) == len(cities) else selected_cities
     
-    filtered_students = students_df[
-        (students_df['РЕГИОН'].isin(selected_regions)) &
-        (students_df['ГОРОД'].isin(selected_cities))
-    ]
-    
-    # Создаем вкладки
-    tab1, tab2, tab3 = st.tabs(["Анализ мероприятий", "Трек студента", "Анализ эффективности"])
-    
-    with tab1:
-        st.header("Анализ мероприятий")
-        
-        # Подсчет участников для каждого мероприятия
-        event_participants = relations_df.groupby('id_мероприятия').size().reset_index(name='Количество участников')
-        event_participants = event_participants.merge(filtered_events, left_on='id_мероприятия', right_on='id')
-        
-        # Сортировка мероприятий
-        sort_by = st.selectbox(
-            "Сортировка",
-            ["По количеству участников (по убыванию)", "По количеству участников (по возрастанию)", "По году (по убыванию)", "По году (по возрастанию)"]
-        )
-        
-        if "по убыванию" in sort_by:
-            ascending = False
-        else:
-            ascending = True
-            
-        if "количеству участников" in sort_by:
-            event_participants = event_participants.sort_values('Количество участников', ascending=ascending)
-        else:
-            event_participants = event_participants.sort_values('Год', ascending=ascending)
-        
-        # Отображение таблицы мероприятий
-        st.dataframe(
-            event_participants[['Мероприятие', 'Тип мероприятия', 'Год', 'Количество участников']],
-            use_container_width=True
-        )
-        
-        # График количества участников по мероприятиям
-        fig = px.bar(
-            event_participants,
-            x='Мероприятие',
-            y='Количество участников',
-            color='Тип мероприятия',
-            title='Количество участников по мероприятиям'
-        )
-        st.plotly_chart(fig, use_container_width=True)
-        
-        # Анализ повторяющихся мероприятий
-        st.subheader("Повторяющиеся мероприятия")
-        recurring_events = event_participants.groupby('Мероприятие').size().reset_index(name='Количество проведений')
-        recurring_events = recurring_events[recurring_events['Количество проведений'] > 1]
-        
-        if not recurring_events.empty:
-            st.dataframe(recurring_events, use_container_width=True)
-            
-            # График динамики участников для повторяющихся мероприятий
-            for event in recurring_events['Мероприятие']:
-                event_data = event_participants[event_participants['Мероприятие'] == event]
-                # Сортируем данные по году
-                event_data = event_data.sort_values('Год')
-                fig = px.line(
-                    event_data,
-                    x='Год',
-                    y='Количество участников',
-                    title=f'Динамика участников: {event}'
-                )
-                # Добавляем настройку оси Y
-                fig.update_layout(
-                    yaxis=dict(
-                        range=[0, event_data['Количество участников'].max() * 1.1]  # Добавляем 10% отступа сверху
-                    )
-                )
-                st.plotly_chart(fig, use_container_width=True)
-    
-    with tab2:
-        st.header("Трек студента")
-        
-        # Выбор студента
-        student_search = st.text_input("Поиск студента (ФИО или телефон)")
-        
-        if student_search:
-            # Преобразуем все значения в строки и экранируем специальные символы
-            student_search = re.escape(student_search)
-            
-            # Поиск по ФИО или телефону
-            filtered_students = students_df[
-                students_df['ФИО'].astype(str).str.contains(student_search, case=False, na=False) |
-                students_df['ТЕЛЕФОН'].astype(str).str.contains(student_search, case=False, na=False)
-            ]
-        
-        if not filtered_students.empty:
-            selected_student = st.selectbox(
-                "Выберите студента",
-                filtered_students['ФИО'].tolist()
-            )
-            
-            if selected_student:
-                student_id = filtered_students[filtered_students['ФИО'] == selected_student]['id'].iloc[0]
-                
-                # Получаем мероприятия студента
-                student_events = relations_df[relations_df['id_студента'] == student_id]
-                student_events = student_events.merge(events_df, left_on='id_мероприятия', right_on='id')
-                
-                # Отображаем информацию о студенте
-                student_info = filtered_students[filtered_students['id'] == student_id].iloc[0]
-                st.subheader("Информация о студенте")
-                st.write(f"ФИО: {student_info['ФИО']}")
-                st.write(f"Регион: {student_info['РЕГИОН']}")
-                st.write(f"Город: {student_info['ГОРОД']}")
-                st.write(f"Школа: {student_info['ШКОЛА']}")
-                
-                # Отображаем мероприятия студента
-                st.subheader("Мероприятия студента")
-                st.dataframe(
-                    student_events[['Мероприятие', 'Тип мероприятия', 'Год']],
-                    use_container_width=True
-                )
-                
-                # Визуализация трека студента
-                fig = go.Figure()
-                
-                # Добавляем курсы
-                courses = student_events[student_events['Тип мероприятия'] == 'Курс']
-                fig.add_trace(go.Scatter(
-                    x=courses['Год'],
-                    y=[1] * len(courses),
-                    mode='markers+text',
-                    name='Курсы',
-                    text=courses['Мероприятие'],
-                    textposition="top center",
-                    marker=dict(size=10, symbol='circle')
-                ))
-                
-                # Добавляем соревнования
-                competitions = student_events[student_events['Тип мероприятия'] == 'Соревнование']
-                fig.add_trace(go.Scatter(
-                    x=competitions['Год'],
-                    y=[2] * len(competitions),
-                    mode='markers+text',
-                    name='Соревнования',
-                    text=competitions['Мероприятие'],
-                    textposition="top center",
-                    marker=dict(size=10, symbol='star')
-                ))
-                
-                fig.update_layout(
-                    title='Трек студента',
-                    yaxis=dict(
-                        showticklabels=False,
-                        range=[0, 3]
-                    ),
-                    showlegend=True
-                )
-                
-                st.plotly_chart(fig, use_container_width=True)
-    
-    with tab3:
-        st.header("Анализ эффективности")
-        
-        # Анализ связи между курсами и соревнованиями
-        st.subheader("Связь между курсами и соревнованиями")
-        
-        # Получаем все пары курс-соревнование для каждого студента
-        course_competition_pairs = []
-        
-        for student_id in relations_df['id_студента'].unique():
-            student_events = relations_df[relations_df['id_студента'] == student_id]
-            student_events = student_events.merge(events_df, left_on='id_мероприятия', right_on='id')
-            
-            # Получаем курсы и соревнования студента
-            courses = student_events[student_events['Тип мероприятия'] == 'Курс']
-            competitions = student_events[student_events['Тип мероприятия'] == 'Соревнование']
-            
-            # Анализируем каждую пару курс-соревнование
-            for _, course in courses.iterrows():
-                for _, competition in competitions.iterrows():
-                    if course['Год'] <= competition['Год']:  # Курс должен быть до соревнования
-                        course_competition_pairs.append({
-                            'Студент': students_df[students_df['id'] == student_id]['ФИО'].iloc[0],
-                            'Курс': course['Мероприятие'],
-                            'Год курса': course['Год'],
-                            'Соревнование': competition['Мероприятие'],
-                            'Год соревнования': competition['Год'],
-                            'Место': competition['Место']
-                        })
-        
-        if course_competition_pairs:
-            pairs_df = pd.DataFrame(course_competition_pairs)
-            
-            # Анализ популярных пар курс-соревнование
-            popular_pairs = pairs_df.groupby(['Курс', 'Соревнование']).agg({
-                'Студент': 'count',
-                'Место': lambda x: {
-                    'Победители': sum(1 for m in x if pd.notna(m) and m == 'Победитель'),
-                    'Призеры': sum(1 for m in x if pd.notna(m) and m == 'Призер'),
-                    'Не заняли места': sum(1 for m in x if pd.notna(m) and m == 'Участник')
-                }
-            }).reset_index()
-            
-            popular_pairs.columns = ['Курс', 'Соревнование', 'Количество студентов', 'Статистика мест']
-            
-            # Добавляем столбцы с количеством победителей, призеров и участников
-            popular_pairs['Победители'] = popular_pairs['Статистика мест'].apply(lambda x: x['Победители'])
-            popular_pairs['Призеры'] = popular_pairs['Статистика мест'].apply(lambda x: x['Призеры'])
-            popular_pairs['Не заняли места'] = popular_pairs['Статистика мест'].apply(lambda x: x['Не заняли места'])
-            
-            # Сортируем по количеству победителей и призеров
-            popular_pairs = popular_pairs.sort_values(['Победители', 'Призеры'], ascending=False)
-            
-            st.write("Популярные пары курс-соревнование:")
-            st.dataframe(popular_pairs[['Курс', 'Соревнование', 'Количество студентов', 'Победители', 'Призеры', 'Не заняли места']], 
-                        use_container_width=True)
-            
-            # Визуализация связей с учетом мест
-            fig = px.scatter(
-                pairs_df,
-                x='Год курса',
-                y='Год соревнования',
-                color='Курс',
-                hover_data=['Студент', 'Соревнование', 'Место'],
-                title='Связь между курсами и соревнованиями по годам'
-            )
-            st.plotly_chart(fig, use_container_width=True)
-            
-            # Анализ эффективности курсов
-            st.subheader("Эффективность курсов")
-            
-            # Группируем данные по курсам
-            course_effectiveness = pairs_df.groupby('Курс').agg({
-                'Студент': 'count',
-                'Место': lambda x: {
-                    'Победители': sum(1 for m in x if pd.notna(m) and m == 'Победитель'),
-                    'Призеры': sum(1 for m in x if pd.notna(m) and m == 'Призер'),
-                    'Не заняли места': sum(1 for m in x if pd.notna(m) and m == 'Участник')
-                }
-            }).reset_index()
-            
-            course_effectiveness.columns = ['Курс', 'Количество студентов', 'Статистика мест']
-            
-            # Добавляем столбцы с количеством победителей, призеров и участников
-            course_effectiveness['Победители'] = course_effectiveness['Статистика мест'].apply(lambda x: x['Победители'])
-            course_effectiveness['Призеры'] = course_effectiveness['Статистика мест'].apply(lambda x: x['Призеры'])
-            course_effectiveness['Не заняли места'] = course_effectiveness['Статистика мест'].apply(lambda x: x['Не заняли места'])
-            
-            # Добавляем процентные показатели
-            course_effectiveness['% Победителей'] = (course_effectiveness['Победители'] / course_effectiveness['Количество студентов'] * 100).round(1)
-            course_effectiveness['% Призеров'] = (course_effectiveness['Призеры'] / course_effectiveness['Количество студентов'] * 100).round(1)
-            course_effectiveness['% Не заняли места'] = (course_effectiveness['Не заняли места'] / course_effectiveness['Количество студентов'] * 100).round(1)
-            
-            # Сортируем по проценту победителей и призеров
-            course_effectiveness = course_effectiveness.sort_values(['% Победителей', '% Призеров'], ascending=False)
-            
-            st.write("Эффективность курсов (по количеству и проценту победителей и призеров):")
-            st.dataframe(course_effectiveness[[
-                'Курс', 'Количество студентов', 
-                'Победители', '% Победителей',
-                'Призеры', '% Призеров',
-                'Не заняли места', '% Не заняли места'
-            ]], use_container_width=True)
-            
-            # Визуализация эффективности курсов
-            fig = px.bar(
-                course_effectiveness,
-                x='Курс',
-                y=['% Победителей', '% Призеров', '% Не заняли места'],
-                title='Эффективность курсов (в процентах)',
-                barmode='group',
-                labels={'value': 'Процент студентов', 'variable': 'Категория'}
-            )
-            st.plotly_chart(fig, use_container_width=True)
-            
-        else:
-            st.write("Не найдено связей между курсами и соревнованиями")
+    # Выбор раздела: выполняется только открытый раздел,
+    # тогда как у st.tabs на каждом перезапуске считаются все вкладки
+    sections = {
+        "Анализ мероприятий": lambda: show_event_analysis(db_path, db_version, event_type, year_filter),
+        "Трек студента": lambda: show_student_track(db_path, db_version, region_filter, city_filter),
+        "Анализ эффективности": lambda: show_effectiveness(db_path, db_version),
+        "Когорты и удержание": lambda: show_cohorts(db_path, db_version, event_type, year_filter, region_filter, city_filter),
+    }
+    section = st.radio("Раздел", list(sections), horizontal=True, key="section")
+    sections[section]()
\ No newline at end of file
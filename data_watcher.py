@@ -0,0 +1,176 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+
+import storage
+from export import WORKBOOK_SHEETS
+
+# Манифест записывается main.py последним, когда все файлы запуска уже готовы
+MANIFEST_NAME = 'manifest.json'
+
+# Как часто (в секундах) проверять, не появился ли новый набор данных
+WATCH_INTERVAL = 10
+
+# Сколько секунд хранить базу прежнего запуска после появления новой. Перезапуск,
+# начатый на прежней версии, должен успеть закончиться, поэтому срок много больше
+# самого долгого перезапуска
+DATABASE_RETENTION = 3600
+
+# Префиксы файлов отдельных таблиц
+FILE_PREFIXES = {
+    'students': 'students_clean_',
+    'events': 'events_clean_',
+    'relations': 'student_event_relations_',
+}
+
+
+def write_manifest(output_dir, manifest):
+    """Атомарно записывает манифест завершенного запуска"""
+    path = Path(output_dir) / MANIFEST_NAME
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def database_name(timestamp):
+    """Имя файла базы запуска: у каждого запуска своя база, и ее содержимое не меняется"""
+    return f'students_{timestamp}.sqlite'
+
+
+def find_databases(data_path):
+    """Базы запусков в data_path: словарь {временная метка: путь}"""
+    databases = {}
+    for file in os.listdir(data_path):
+        match = re.search(r'^students_(\d{8}_\d{6})\.sqlite$', file)
+        if match:
+            databases[match.group(1)] = Path(data_path) / file
+    return databases
+
+
+def find_latest_files(data_path):
+    """Последний полный набор файлов (база или Excel), если манифеста нет"""
+    datasets = {}
+    for file in os.listdir(data_path):
+        match = re.search(r'^(\w+?_)(\d{8}_\d{6})\.(xlsx|sqlite)$', file)
+        if match:
+            datasets.setdefault(match.group(2), set()).add(match.group(1) + match.group(3))
+
+    # Перебираем временные метки от последней (формат ГГГГММДД_ЧЧММСС)
+    for timestamp in sorted(datasets, reverse=True):
+        prefixes = datasets[timestamp]
+        if 'students_sqlite' in prefixes:
+            return timestamp, {'db': database_name(timestamp)}
+        if 'students_data_xlsx' in prefixes:
+            return timestamp, {'workbook': f'students_data_{timestamp}.xlsx'}
+        if {f'{prefix}xlsx' for prefix in FILE_PREFIXES.values()} <= prefixes:
+            return timestamp, {table: f'{prefix}{timestamp}.xlsx' for table, prefix in FILE_PREFIXES.items()}
+    return None, None
+
+
+def find_latest_dataset(data_path):
+    """Описание последнего полностью записанного набора данных или None"""
+    data_path = Path(data_path)
+    manifest_path = data_path / MANIFEST_NAME
+    if manifest_path.exists():
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        return {
+            'version': manifest['timestamp'],
+            'db': str(data_path / manifest['db']) if manifest.get('db') else None,
+            'files': {table: str(data_path / file) for table, file in manifest['files'].items()},
+        }
+
+    if not data_path.exists():
+        return None
+    timestamp, files = find_latest_files(data_path)
+    if timestamp is None:
+        return None
+    return {
+        'version': timestamp,
+        'db': str(data_path / files.pop('db')) if 'db' in files else None,
+        'files': {table: str(data_path / file) for table, file in files.items()},
+    }
+
+
+def read_tables(files):
+    """Читает студентов, мероприятия и связи из Excel-файлов набора"""
+    if 'workbook' in files:
+        sheets = pd.read_excel(files['workbook'], sheet_name=None)
+        return tuple(sheets[WORKBOOK_SHEETS[table]] for table in FILE_PREFIXES)
+    return tuple(pd.read_excel(files[table]) for table in FILE_PREFIXES)
+
+
+def prune_databases(data_path, current, retention=DATABASE_RETENTION):
+    """Удаляет базы прежних запусков, которые перестали быть последними больше retention секунд назад.
+
+    Последняя база и текущая база дашборда не удаляются"""
+    databases = find_databases(data_path)
+    timestamps = sorted(databases)
+    now = time.time()
+    for older, newer in zip(timestamps, timestamps[1:]):
+        path = databases[older]
+        if current is not None and path.name == Path(current).name:
+            continue
+        # База перестала быть последней, когда записали следующую
+        if now - os.path.getmtime(databases[newer]) > retention:
+            path.unlink(missing_ok=True)
+
+
+def prepare_dataset(dataset, data_path):
+    """Проверяет базу набора данных и возвращает путь к ней.
+
+    У каждого запуска своя база students_<метка>.sqlite, которая после записи
+    не меняется, поэтому под одной версией дашборд всегда видит одни данные"""
+    db_path = dataset['db']
+    if not db_path or not Path(db_path).exists():
+        # Если базы нет, один раз переносим Excel-файлы в базу запуска рядом с ними
+        db_path = str(Path(data_path) / database_name(dataset['version']))
+        if not Path(db_path).exists():
+            storage.save_to_sqlite(*read_tables(dataset['files']), db_path)
+
+    # Проверяем, что база читается, и заодно прогреваем файловый кэш
+    storage.load_filter_values(db_path)
+    return db_path
+
+
+def start_watcher(data_path, interval=WATCH_INTERVAL, retention=DATABASE_RETENTION):
+    """Готовит текущий набор данных и запускает фоновую проверку новых наборов.
+
+    Возвращает общий для всех сессий словарь, в котором значение 'current' -
+    кортеж (путь к базе, версия) - заменяется целиком, только когда новый набор
+    полностью подготовлен. Поэтому сессии не ждут загрузки и не видят
+    наполовину записанных файлов. Базы прежних запусков удаляются через retention
+    секунд после смены версии, в том числе оставшиеся от прошлых процессов"""
+    state = {'current': None}
+
+    def refresh():
+        dataset = find_latest_dataset(data_path)
+        if dataset is not None and (state['current'] is None or state['current'][1] != dataset['version']):
+            state['current'] = (prepare_dataset(dataset, data_path), dataset['version'])
+            print(f'Загружен набор данных: {dataset["version"]}')
+        if state['current'] is not None:
+            prune_databases(data_path, state['current'][0], retention)
+
+    def watch():
+        while True:
+            time.sleep(interval)
+            try:
+                refresh()
+            except Exception as error:
+                # Оставляем прежний набор и пробуем снова на следующей проверке
+                print(f'Не удалось загрузить новый набор данных: {error}', file=sys.stderr)
+
+    try:
+        refresh()
+    except Exception as error:
+        print(f'Не удалось загрузить набор данных: {error}', file=sys.stderr)
+
+    threading.Thread(target=watch, name='dataset-watcher', daemon=True).start()
+    return state
@@ -0,0 +1,71 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from openpyxl import Workbook
+
+# Количество строк, которые за раз переводятся из DataFrame в строки листа
+EXPORT_BATCH_SIZE = 10000
+
+# Листы книги, в которую таблицы сохраняются вместе
+WORKBOOK_SHEETS = {
+    'students': 'Студенты',
+    'events': 'Мероприятия',
+    'relations': 'Связи',
+}
+
+
+def iter_rows(df, batch_size=EXPORT_BATCH_SIZE):
+    """Отдает заголовок и строки таблицы пачками, пропуски заменяются пустыми ячейками"""
+    yield list(df.columns)
+    for start in range(0, len(df), batch_size):
+        batch = df.iloc[start:start + batch_size].astype(object)
+        batch = batch.where(batch.notna(), None)
+        yield from batch.itertuples(index=False, name=None)
+
+
+def write_workbook(path, sheets):
+    """Записывает таблицы на листы книги в режиме только записи.
+
+    В этом режиме openpyxl сбрасывает строки на диск по мере добавления
+    и не держит книгу в памяти целиком"""
+    workbook = Workbook(write_only=True)
+    for title, df in sheets.items():
+        sheet = workbook.create_sheet(title)
+        for row in iter_rows(df):
+            sheet.append(row)
+
+    # Пишем во временный файл, чтобы не оставить наполовину записанную книгу
+    tmp_path = f'{path}.tmp'
+    workbook.save(tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+# Книги текущей выгрузки: дочерние процессы получают их при fork вместе с памятью
+# родителя, поэтому таблицы не сериализуются и не копируются в каждый процесс
+_export_files = {}
+
+
+def write_export_workbook(path):
+    """Записывает книгу выгрузки, таблицы берутся из унаследованного _export_files"""
+    return write_workbook(path, _export_files[path])
+
+
+def export_excel(files):
+    """Записывает книги параллельно, по процессу на файл.
+
+    files - словарь {путь: {название листа: DataFrame}}. Без fork (Windows, macOS)
+    книги записываются по очереди в текущем процессе"""
+    if 'fork' not in multiprocessing.get_all_start_methods():
+        return [write_workbook(path, sheets) for path, sheets in files.items()]
+
+    _export_files.update(files)
+    try:
+        # Процессы создаются после заполнения _export_files и видят таблицы без копирования
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=len(files), mp_context=context) as executor:
+            futures = [executor.submit(write_export_workbook, path) for path in files]
+            return [future.result() for future in futures]
+    finally:
+        _export_files.clear()
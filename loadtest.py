@@ -0,0 +1,303 @@
+import argparse
+import asyncio
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import yaml
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from streamlit.runtime.state.common import user_key_from_widget_id
+from tornado.websocket import websocket_connect
+
+from data_watcher import database_name, write_manifest
+from storage import save_to_sqlite
+
+DASHBOARD_PATH = Path(__file__).resolve().parent / 'dashboard.py'
+
+# Пароль, который нагрузочный тест записывает в свою конфигурацию
+LOADTEST_PASSWORD = 'loadtest'
+
+# Сколько секунд ждать запуска сервера streamlit
+SERVER_START_TIMEOUT = 60
+
+SURNAMES = ['Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Соколов', 'Михайлов', 'Новиков']
+NAMES = ['Иван', 'Петр', 'Алексей', 'Мария', 'Анна', 'Ольга', 'Дмитрий', 'Сергей']
+PATRONYMICS = ['Иванович', 'Петрович', 'Сергеевич', 'Алексеевна', 'Дмитриевна']
+REGIONS = ['Московская область', 'Ленинградская область', 'Санкт-Петербург', 'Москва', 'Новосибирская область']
+CITIES = ['Москва', 'Санкт-Петербург', 'Новосибирск', 'Екатеринбург', 'Казань', 'Химки', 'Пушкин']
+PLACES = ['Победитель', 'Призер', 'Участник']
+
+
+def generate_dataset(data_path, students, events, relations_per_student, seed=0):
+    """Создает синтетический набор данных заданного размера в data_path"""
+    rng = np.random.default_rng(seed)
+
+    students_df = pd.DataFrame({
+        'id': np.arange(1, students + 1),
+        'ФИО': (pd.Series(rng.choice(SURNAMES, students)) + ' '
+                + pd.Series(rng.choice(NAMES, students)) + ' '
+                + pd.Series(rng.choice(PATRONYMICS, students))),
+        'ТЕЛЕФОН': ['+79' + f'{number:09d}' for number in rng.integers(0, 10 ** 9, students)],
+        'РЕГИОН': rng.choice(REGIONS, students),
+        'ГОРОД': rng.choice(CITIES, students),
+        'ШКОЛА': [f'Школа {number}' for number in rng.integers(1, 300, students)],
+        'ДАТА РОЖДЕНИЯ': [f'{day:02d}.{month:02d}.{year}' for day, month, year in zip(
+            rng.integers(1, 29, students), rng.integers(1, 13, students), rng.integers(2005, 2015, students))],
+        'ЭЛ.ПОЧТА': None,
+        'ТЕЛЕГРАМ': None,
+    })
+
+    # Названия повторяются, чтобы были повторяющиеся мероприятия
+    event_types = rng.choice(['Курс', 'Соревнование'], events)
+    events_df = pd.DataFrame({
+        'id': np.arange(1, events + 1),
+        'Мероприятие': [f'{event_type} {number}' for event_type, number in zip(
+            event_types, rng.integers(1, max(events // 3, 1) + 1, events))],
+        'Тип мероприятия': event_types,
+        'Год': rng.integers(2018, 2026, events),
+    })
+
+    relations_df = pd.DataFrame({
+        'id_студента': np.repeat(students_df['id'].to_numpy(), relations_per_student),
+        'id_мероприятия': rng.integers(1, events + 1, students * relations_per_student),
+    }).drop_duplicates(ignore_index=True)
+    is_competition = event_types[relations_df['id_мероприятия'].to_numpy() - 1] == 'Соревнование'
+    relations_df['Место'] = np.where(is_competition, rng.choice(PLACES, len(relations_df)), None)
+    relations_df.insert(0, 'id', np.arange(1, len(relations_df) + 1))
+
+    # Набор записывается так же, как его записывает main.py
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    save_to_sqlite(students_df, events_df, relations_df, str(Path(data_path) / database_name(timestamp)))
+    write_manifest(data_path, {'timestamp': timestamp, 'files': {}, 'db': database_name(timestamp)})
+
+
+def start_server(work_dir, port):
+    """Запускает дашборд через streamlit run и ждет, пока сервер ответит"""
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'streamlit', 'run', str(DASHBOARD_PATH),
+         '--server.headless', 'true', '--server.port', str(port), '--browser.gatherUsageStats', 'false'],
+        # Дашборд и auth читают config.yaml из текущего каталога
+        cwd=work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/_stcore/health')
+            return server
+        except OSError:
+            if server.poll() is not None:
+                break
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f'Сервер streamlit не запустился на порту {port}')
+
+
+def memory_usage(pid):
+    """Текущий объем памяти процесса (RSS) в МБ или None, если он недоступен"""
+    status = Path(f'/proc/{pid}/status')
+    if not status.exists():
+        return None
+    for line in status.read_text().splitlines():
+        if line.startswith('VmRSS:'):
+            return int(line.split()[1]) / 1024
+    return None
+
+
+def set_widget(session, key, value):
+    """Задает значение виджета так же, как его отправил бы браузер"""
+    element_type, element = session['widgets'][key]
+    state = WidgetState(id=element.id)
+    if element_type == 'text_input':
+        state.string_value = value
+    elif element_type in ('selectbox', 'radio'):
+        state.int_value = list(element.options).index(value)
+    elif element_type == 'multiselect':
+        state.int_array_value.data.extend(list(element.options).index(item) for item in value)
+    else:
+        raise ValueError(f'Неподдерживаемый виджет {element_type}: {key}')
+    session['states'][key] = state
+
+
+def widget_options(session, key):
+    return list(session['widgets'][key][1].options)
+
+
+async def rerun(session):
+    """Отправляет состояние виджетов, ждет конца перезапуска и возвращает, была ли ошибка"""
+    message = BackMsg()
+    message.rerun_script.SetInParent()
+    # Браузер отправляет состояние только тех виджетов, которые есть на странице
+    for key, state in session['states'].items():
+        if key in session['widgets']:
+            message.rerun_script.widget_states.widgets.append(state)
+    await session['connection'].write_message(message.SerializeToString(), binary=True)
+
+    widgets = {}
+    error = False
+    while True:
+        data = await session['connection'].read_message()
+        if data is None:
+            raise ConnectionError('Сервер закрыл соединение')
+        forward = ForwardMsg.FromString(data)
+        kind = forward.WhichOneof('type')
+        if kind == 'delta' and forward.delta.WhichOneof('type') == 'new_element':
+            element_type = forward.delta.new_element.WhichOneof('type')
+            element = getattr(forward.delta.new_element, element_type)
+            if element_type == 'exception':
+                error = True
+            elif getattr(element, 'id', None) and user_key_from_widget_id(element.id):
+                widgets[user_key_from_widget_id(element.id)] = (element_type, element)
+        elif kind == 'script_finished':
+            session['widgets'] = widgets
+            return error or forward.script_finished != ForwardMsg.FINISHED_SUCCESSFULLY
+
+
+# Сценарий одной сессии: (название шага, действие перед перезапуском)
+SCENARIO = [
+    ('Открытие страницы', lambda session: None),
+    ('Вход', lambda session: set_widget(session, 'password', LOADTEST_PASSWORD)),
+    ('Фильтр по типу', lambda session: set_widget(session, 'event_type', 'Соревнование')),
+    ('Фильтр по году', lambda session: set_widget(session, 'years', widget_options(session, 'years')[1:])),
+    ('Трек студента', lambda session: set_widget(session, 'section', 'Трек студента')),
+    ('Поиск студента', lambda session: set_widget(session, 'student_search', 'Иванов')),
+    ('Анализ эффективности', lambda session: set_widget(session, 'section', 'Анализ эффективности')),
+    ('Когорты и удержание', lambda session: set_widget(session, 'section', 'Когорты и удержание')),
+    ('Анализ мероприятий', lambda session: set_widget(session, 'section', 'Анализ мероприятий')),
+]
+
+
+async def run_session(port, results, connections, iterations, think_time, timeout, rng):
+    """Проходит сценарий одной сессии и записывает время каждого перезапуска.
+
+    Ошибка на любом шаге записывается и завершает сессию, остальные сессии продолжают работу"""
+    # Пользователи открывают страницу не одновременно
+    await asyncio.sleep(rng.uniform(0, think_time))
+    for _ in range(iterations):
+        session = {'widgets': {}, 'states': {}}
+        for step, action in SCENARIO:
+            started = time.perf_counter()
+            try:
+                if 'connection' not in session:
+                    session['connection'] = await websocket_connect(f'ws://127.0.0.1:{port}/_stcore/stream')
+                    # Соединение остается открытым до конца уровня, как вкладка браузера
+                    connections.append(session['connection'])
+                action(session)
+                error = await asyncio.wait_for(rerun(session), timeout)
+            except Exception as exception:
+                results.append({'Шаг': step, 'Время, с': time.perf_counter() - started, 'Ошибка': True,
+                                'Причина': f'{type(exception).__name__}: {exception}'})
+                return
+            results.append({'Шаг': step, 'Время, с': time.perf_counter() - started, 'Ошибка': error})
+            await asyncio.sleep(think_time * rng.uniform(0.5, 1.5))
+
+
+async def run_level(port, server_pid, sessions, iterations, think_time, timeout, seed):
+    """Запускает sessions одновременных сессий на одном сервере и собирает время перезапусков"""
+    results = []
+    connections = []
+    memory_before = memory_usage(server_pid)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        run_session(port, results, connections, iterations, think_time, timeout, np.random.default_rng(seed + number))
+        for number in range(sessions)
+    ])
+    duration = time.perf_counter() - started
+
+    # Память меряем, пока все сессии еще подключены
+    memory_after = memory_usage(server_pid)
+    for connection in connections:
+        connection.close()
+
+    memory_per_session = None
+    if memory_before is not None and memory_after is not None:
+        memory_per_session = (memory_after - memory_before) / sessions
+    return pd.DataFrame(results, columns=['Шаг', 'Время, с', 'Ошибка', 'Причина']), duration, memory_per_session
+
+
+def percentiles(times):
+    """Количество перезапусков и перцентили их времени"""
+    return pd.Series({
+        'Перезапусков': len(times),
+        'p50, с': np.percentile(times, 50),
+        'p95, с': np.percentile(times, 95),
+        'p99, с': np.percentile(times, 99),
+    })
+
+
+def latency_table(reruns):
+    """Перцентили времени перезапуска по шагам сценария и в целом"""
+    by_step = reruns.groupby('Шаг', sort=False)['Время, с'].apply(percentiles).unstack()
+    by_step.loc['Все шаги'] = percentiles(reruns['Время, с'])
+    by_step['Перезапусков'] = by_step['Перезапусков'].astype(int)
+    return by_step.round(3)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Нагрузочный тест дашборда: одновременные сессии к серверу streamlit на синтетических данных'
+    )
+    parser.add_argument('--sessions', type=int, nargs='+', default=[1, 5, 10, 20],
+                        help='количество одновременных сессий; несколько значений - несколько уровней нагрузки')
+    parser.add_argument('--iterations', type=int, default=1, help='сколько раз каждая сессия проходит сценарий')
+    parser.add_argument('--think-time', type=float, default=0.5, help='средняя пауза пользователя между действиями, с')
+    parser.add_argument('--students', type=int, default=10000, help='количество студентов в синтетических данных')
+    parser.add_argument('--events', type=int, default=300, help='количество мероприятий')
+    parser.add_argument('--relations-per-student', type=int, default=3, help='мероприятий на студента')
+    parser.add_argument('--timeout', type=float, default=120, help='предельное время одного перезапуска, с')
+    parser.add_argument('--port', type=int, default=8599, help='порт сервера streamlit для теста')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        data_path = Path(work_dir) / 'data'
+        data_path.mkdir()
+        generate_dataset(data_path, args.students, args.events, args.relations_per_student)
+        with open(Path(work_dir) / 'config.yaml', 'w') as f:
+            yaml.safe_dump({'password': LOADTEST_PASSWORD, 'data_path': str(data_path)}, f, allow_unicode=True)
+
+        server = start_server(work_dir, args.port)
+        try:
+            # Прогрев: первая сессия загружает набор данных и заполняет общие кэши
+            warmup, _, _ = asyncio.run(run_level(args.port, server.pid, 1, 1, 0, args.timeout, seed=0))
+            if warmup['Ошибка'].any():
+                print(f'Прогрев завершился с ошибкой: {warmup["Причина"].dropna().tolist()}')
+
+            summary = []
+            for sessions in args.sessions:
+                reruns, duration, memory_per_session = asyncio.run(run_level(
+                    args.port, server.pid, sessions, args.iterations, args.think_time, args.timeout, seed=sessions
+                ))
+                print(f'Сессий: {sessions}, длительность: {duration:.1f} с, '
+                      f'перезапусков с ошибкой: {int(reruns["Ошибка"].sum())}')
+                for reason in reruns['Причина'].dropna().unique():
+                    print(f'  {reason}')
+                print(latency_table(reruns).to_string())
+                print()
+
+                summary.append({
+                    'Сессий': sessions,
+                    **percentiles(reruns['Время, с']).round(3),
+                    'Перезапусков в секунду': round(len(reruns) / duration, 1),
+                    'С ошибкой': int(reruns['Ошибка'].sum()),
+                    'Память на сессию, МБ': None if memory_per_session is None else round(memory_per_session, 1),
+                })
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f'Студентов: {args.students}, мероприятий: {args.events}, пауза пользователя: {args.think_time} с')
+    summary = pd.DataFrame(summary).set_index('Сессий')
+    summary['Перезапусков'] = summary['Перезапусков'].astype(int)
+    print(summary.to_string())
+
+
+if __name__ == '__main__':
+    main()
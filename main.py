@@ -1,8 +1,16 @@
 import pandas as pd
+import numpy as np
 import re
 from datetime import datetime
 from unidecode import unidecode
 from difflib import SequenceMatcher
+from itertools import combinations
+import argparse
+from pathlib import Path
+from storage import save_to_sqlite
+from pipeline_cache import cached_stage, DEFAULT_CACHE_SIZE
+from export import export_excel, WORKBOOK_SHEETS
+from data_watcher import write_manifest, database_name, prune_databases
 
 def clean_phone(phone):
     if pd.isna(phone):
@@ -173,100 +181,213 @@ def clean_region(region):
     # Если регион не найден в словаре замен, приводим к формату "Первая буква заглавная"
     return region.title()
 
-def find_duplicates(df):
-    # Создаем копию DataFrame для работы
-    df_clean = df.copy()
+def clean_email(email):
+    if pd.isna(email):
+        return None
+    
+    # Регистр и пробелы в адресе почты не различаем
+    email = str(email).strip().lower()
+    return email or None
+
+def clean_telegram(telegram):
+    if pd.isna(telegram):
+        return None
     
-    # Очищаем все поля
-    df_clean['ФИО'] = df_clean['ФИО'].apply(clean_fio)
-    df_clean['ТЕЛЕФОН'] = df_clean['ТЕЛЕФОН'].apply(clean_phone)
-    df_clean['ДАТА РОЖДЕНИЯ'] = df_clean['ДАТА РОЖДЕНИЯ'].apply(clean_date)
+    telegram = str(telegram).strip().lower()
     
-    # Создаем список для хранения групп дубликатов
+    # Приводим ссылки и имена с @ и без к виду @имя
+    telegram = re.sub(r'^(https?://)?(t\.me|telegram\.me)/', '', telegram)
+    telegram = telegram.lstrip('@')
+    return f'@{telegram}' if telegram else None
+
+# Поля, по совпадению которых ищутся дубликаты
+MATCH_KEY_COLUMNS = ['ТЕЛЕФОН', 'ДАТА РОЖДЕНИЯ', 'ЭЛ.ПОЧТА', 'ТЕЛЕГРАМ']
+
+def intern_match_keys(df):
+    """Кодирует поля сравнения целыми числами: одно значение - один код, пропуск - -1.
+    Возвращает матрицу int32 со столбцами в порядке MATCH_KEY_COLUMNS"""
+    cleaners = {
+        'ТЕЛЕФОН': clean_phone,
+        'ДАТА РОЖДЕНИЯ': clean_date,
+        'ЭЛ.ПОЧТА': clean_email,
+        'ТЕЛЕГРАМ': clean_telegram,
+    }
+    codes = [pd.factorize(df[column].apply(cleaners[column]))[0] for column in MATCH_KEY_COLUMNS]
+    return np.column_stack(codes).astype(np.int32).reshape(len(df), len(MATCH_KEY_COLUMNS))
+
+# Размер окна метода отсортированного соседства: каждая запись сравнивается
+# со следующими NEIGHBOURHOOD_WINDOW записями в каждой из сортировок по ФИО
+NEIGHBOURHOOD_WINDOW = 10
+
+# Упрощенная фонетика: звонкие согласные заменяем глухими, близкие гласные объединяем
+PHONETIC_TABLE = str.maketrans({
+    'б': 'п', 'в': 'ф', 'г': 'к', 'д': 'т', 'ж': 'ш', 'з': 'с',
+    'о': 'а', 'я': 'а', 'ё': 'е', 'э': 'е', 'ю': 'у', 'ы': 'и', 'й': 'и',
+    'ь': None, 'ъ': None,
+})
+
+def phonetic_key(word):
+    """Фонетический ключ: похожие по звучанию написания дают один ключ"""
+    word = word.lower().translate(PHONETIC_TABLE)
+    # Убираем повторяющиеся буквы
+    return re.sub(r'(.)\1+', r'\1', word)
+
+def name_sort_keys(fio, birth_date):
+    """Ключи сортировки: фамилия и имя, фонетическая фамилия, имя в транслитерации.
+    Дата рождения в конце каждого ключа ставит рядом однофамильцев с одной датой рождения"""
+    parts = split_fio(fio.lower().replace('ё', 'е'))
+    surname = parts['фамилия'] or ''
+    name = parts['имя'] or ''
+    patronymic = parts['отчество'] or ''
+    birth_date = birth_date or ''
+    return (
+        f'{surname} {name} {patronymic}|{birth_date}',
+        f'{phonetic_key(surname)} {name}|{birth_date}',
+        f'{unidecode(name)} {unidecode(surname)}|{birth_date}',
+    )
+
+def find_neighbour_pairs(fios, birth_dates, window=NEIGHBOURHOOD_WINDOW):
+    """Пары записей, стоящих рядом хотя бы в одной из сортировок по ФИО"""
+    positions = [pos for pos, fio in enumerate(fios) if fio is not None]
+    if not positions:
+        return np.empty((0, 2), dtype=int)
+    keys = pd.DataFrame([name_sort_keys(fios[pos], birth_dates[pos]) for pos in positions], index=positions)
+    
+    pairs = []
+    for column in keys.columns:
+        order = keys[column].sort_values(kind='stable').index.to_numpy()
+        for shift in range(1, min(window, len(order) - 1) + 1):
+            pairs.append(np.column_stack([order[:-shift], order[shift:]]))
+    if not pairs:
+        return np.empty((0, 2), dtype=int)
+    return np.concatenate(pairs)
+
+def combine_keys(match_keys, columns):
+    """Общий код нескольких полей записи, -1 - если хотя бы одно из полей пустое"""
+    combined = np.zeros(len(match_keys), dtype=np.int64)
+    missing = np.zeros(len(match_keys), dtype=bool)
+    for column in columns:
+        codes = match_keys[:, MATCH_KEY_COLUMNS.index(column)].astype(np.int64)
+        combined = combined * (codes.max(initial=0) + 1) + codes
+        missing |= codes < 0
+    combined[missing] = -1
+    return combined
+
+def bucket_pairs(codes):
+    """Все пары позиций с одинаковым кодом, пропуски (код -1) не сравниваем"""
+    order = np.argsort(codes, kind='stable')
+    order = order[codes[order] >= 0]
+    sorted_codes = codes[order]
+    
+    # Границы групп одинаковых кодов в отсортированном массиве
+    bounds = np.concatenate([[0], np.flatnonzero(np.diff(sorted_codes)) + 1, [len(sorted_codes)]])
+    ends = np.repeat(bounds[1:], np.diff(bounds))
+    
+    # Каждая позиция образует пары со всеми следующими позициями своей группы
+    positions = np.arange(len(sorted_codes))
+    counts = ends - positions - 1
+    first = np.repeat(positions, counts)
+    second = first + 1 + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.column_stack([order[first], order[second]]).astype(np.int64)
+
+def find_shared_key_pairs(match_keys, column_groups):
+    """Пары записей, у которых совпадают все поля хотя бы одной из групп column_groups"""
+    pairs = [bucket_pairs(combine_keys(match_keys, columns)) for columns in column_groups]
+    return np.concatenate(pairs).reshape(-1, 2)
+
+def build_candidates(pairs, size):
+    """Списки кандидатов каждой записи в формате CSR: соседи записи pos - neighbours[indptr[pos]:indptr[pos + 1]]"""
+    first = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    second = np.concatenate([pairs[:, 1], pairs[:, 0]])
+    # Убираем повторы пар, сортируя их по первой записи, затем по второй
+    encoded = np.unique(first * size + second)
+    indptr = np.searchsorted(encoded // size, np.arange(size + 1))
+    return indptr, encoded % size
+
+def group_duplicates(index, candidates, is_duplicate):
+    """Жадно собирает группы: запись и еще не сгруппированные кандидаты, прошедшие проверку"""
+    indptr, neighbours = candidates
     duplicate_groups = []
-    processed_indices = set()
+    processed = np.zeros(len(index), dtype=bool)
     
     # Проходим по всем строкам
-    for idx, row in df_clean.iterrows():
-        if idx in processed_indices:
+    for pos in range(len(index)):
+        if processed[pos]:
             continue
         
-        # Находим потенциальные дубликаты по ФИО
-        potential_duplicates = []
-        for other_idx, other_row in df_clean.iterrows():
-            if other_idx != idx and other_idx not in processed_indices:
-                # Проверяем схожесть ФИО
-                if compare_fio_parts(row['ФИО'], other_row['ФИО']):
-                    # Проверяем совпадение хотя бы одного из полей
-                    if ((row['ТЕЛЕФОН'] == other_row['ТЕЛЕФОН'] and row['ТЕЛЕФОН'] is not None) or
-                        (row['ДАТА РОЖДЕНИЯ'] == other_row['ДАТА РОЖДЕНИЯ'] and row['ДАТА РОЖДЕНИЯ'] is not None) or
-                        (row['ЭЛ.ПОЧТА'] == other_row['ЭЛ.ПОЧТА'] and row['ЭЛ.ПОЧТА'] is not None) or
-                        (row['ТЕЛЕГРАМ'] == other_row['ТЕЛЕГРАМ'] and row['ТЕЛЕГРАМ'] is not None)):
-                        potential_duplicates.append(other_idx)
+        others = neighbours[indptr[pos]:indptr[pos + 1]]
+        others = others[~processed[others]]
+        potential_duplicates = others[is_duplicate(pos, others)] if len(others) else others
         
-        if potential_duplicates:
-            duplicate_groups.append([idx] + potential_duplicates)
-            processed_indices.update([idx] + potential_duplicates)
+        if len(potential_duplicates):
+            duplicate_groups.append([pos] + potential_duplicates.tolist())
+            processed[pos] = True
+            processed[potential_duplicates] = True
     
-    return duplicate_groups
+    # Переводим позиции строк обратно в индексы DataFrame
+    return [[index[pos] for pos in group] for group in duplicate_groups]
 
-def find_duplicates_by_fields(df):
-    """Находит дубликаты по совпадению минимум двух полей из: телефон, дата рождения, почта, телеграм"""
-    # Создаем копию DataFrame для работы
-    df_clean = df.copy()
+def count_matching_keys(match_keys, pos, others):
+    """Количество совпадающих полей между записью pos и каждой из записей others"""
+    row = match_keys[pos]
+    return ((match_keys[others] == row) & (row >= 0)).sum(axis=1)
+
+def find_duplicates(df, window=NEIGHBOURHOOD_WINDOW, match_keys=None):
+    # Очищаем ФИО и дату рождения для сортировок по ФИО
+    fios = df['ФИО'].apply(clean_fio).tolist()
+    birth_dates = df['ДАТА РОЖДЕНИЯ'].apply(clean_date).tolist()
+    if match_keys is None:
+        match_keys = intern_match_keys(df)
+    
+    # Кандидаты в дубликаты вместо полного перебора всех пар:
+    # записи с общим телефоном, почтой или телеграмом и соседние записи в сортировках по ФИО.
+    # Соседство находит записи без контактов, которые совпадают только по ФИО и дате рождения
+    pairs = np.concatenate([
+        find_shared_key_pairs(match_keys, [['ТЕЛЕФОН'], ['ЭЛ.ПОЧТА'], ['ТЕЛЕГРАМ']]),
+        find_neighbour_pairs(fios, birth_dates, window),
+    ])
     
-    # Очищаем поля
-    df_clean['ТЕЛЕФОН'] = df_clean['ТЕЛЕФОН'].apply(clean_phone)
-    df_clean['ДАТА РОЖДЕНИЯ'] = df_clean['ДАТА РОЖДЕНИЯ'].apply(clean_date)
+    def is_duplicate(pos, others):
+        # Проверяем совпадение хотя бы одного из полей, затем схожесть ФИО.
+        # Запись без ФИО может попасть в кандидаты по контактам, но дубликатом по ФИО не считается
+        matches = count_matching_keys(match_keys, pos, others) >= 1
+        for i in np.flatnonzero(matches):
+            matches[i] = (fios[pos] is not None and fios[others[i]] is not None
+                          and compare_fio_parts(fios[pos], fios[others[i]]))
+        return matches
     
-    # Создаем список для хранения групп дубликатов
-    duplicate_groups = []
-    processed_indices = set()
+    return group_duplicates(df.index, build_candidates(pairs, len(df)), is_duplicate)
+
+def find_duplicates_by_fields(df, match_keys=None):
+    """Находит дубликаты по совпадению минимум двух полей из: телефон, дата рождения, почта, телеграм"""
+    if match_keys is None:
+        match_keys = intern_match_keys(df)
     
-    # Проходим по всем строкам
-    for idx, row in df_clean.iterrows():
-        if idx in processed_indices:
-            continue
-        
-        # Находим потенциальные дубликаты по полям
-        potential_duplicates = []
-        for other_idx, other_row in df_clean.iterrows():
-            if other_idx != idx and other_idx not in processed_indices:
-                # Считаем количество совпадающих полей
-                matching_fields = 0
-                if row['ТЕЛЕФОН'] == other_row['ТЕЛЕФОН'] and row['ТЕЛЕФОН'] is not None:
-                    matching_fields += 1
-                if row['ДАТА РОЖДЕНИЯ'] == other_row['ДАТА РОЖДЕНИЯ'] and row['ДАТА РОЖДЕНИЯ'] is not None:
-                    matching_fields += 1
-                if row['ЭЛ.ПОЧТА'] == other_row['ЭЛ.ПОЧТА'] and row['ЭЛ.ПОЧТА'] is not None:
-                    matching_fields += 1
-                if row['ТЕЛЕГРАМ'] == other_row['ТЕЛЕГРАМ'] and row['ТЕЛЕГРАМ'] is not None:
-                    matching_fields += 1
-                
-                # Если совпадает минимум 2 поля, считаем записи дубликатами
-                if matching_fields >= 2:
-                    potential_duplicates.append(other_idx)
-        
-        if potential_duplicates:
-            duplicate_groups.append([idx] + potential_duplicates)
-            processed_indices.update([idx] + potential_duplicates)
+    # Записи с двумя совпадающими полями совпадают по какой-то паре полей, поэтому
+    # сравниваем только записи с общими значениями пары полей. Блоки по паре полей
+    # намного меньше блоков по одному полю, например по одной дате рождения
+    pairs = find_shared_key_pairs(match_keys, list(combinations(MATCH_KEY_COLUMNS, 2)))
     
-    return duplicate_groups
-
-def merge_duplicate_rows(group):
-    # Сортируем по году в обратном порядке (новые записи первыми)
-    group = group.sort_values('Год', ascending=False)
+    def is_duplicate(pos, others):
+        # Если совпадает минимум 2 поля, считаем записи дубликатами
+        return count_matching_keys(match_keys, pos, others) >= 2
     
-    # Берем первую строку как основу
-    result = group.iloc[0].copy()
+    return group_duplicates(df.index, build_candidates(pairs, len(df)), is_duplicate)
+
+def merge_duplicate_groups(df, duplicate_groups):
+    """Объединяет все группы дубликатов за один проход, по строке на группу"""
+    # Номер группы для каждой строки и порядок строк внутри группы
+    indices = [idx for group_indices in duplicate_groups for idx in group_indices]
+    rows = df.loc[indices].reset_index(drop=True)
+    rows['_группа'] = [number for number, group_indices in enumerate(duplicate_groups) for _ in group_indices]
+    rows['_порядок'] = range(len(rows))
     
-    # Проходим по остальным строкам и заполняем пустые значения
-    for _, row in group.iloc[1:].iterrows():
-        for column in group.columns:
-            if pd.isna(result[column]) and not pd.isna(row[column]):
-                result[column] = row[column]
+    # Сортируем по году в обратном порядке (новые записи первыми)
+    rows = rows.sort_values(['_группа', 'Год', '_порядок'], ascending=[True, False, True])
     
-    return result
+    # Берем первое непустое значение каждого столбца внутри группы
+    merged = rows.groupby('_группа').first()
+    return merged.drop(columns='_порядок').reindex(columns=df.columns)
 
 def find_similar_names(names, threshold=0.8):
     """Находит похожие названия и объединяет их"""
@@ -303,55 +424,72 @@ def find_similar_names(names, threshold=0.8):
     
     return similar_groups
 
-def parse_competition_place(status):
-    """Определяет место в соревновании на основе статуса"""
-    if pd.isna(status):
-        return None
-    
-    status = str(status).lower().strip()
-    
-    # Ключевые слова для определения места (в нижнем регистре)
-    winner_keywords = ['1 место', 'первое место', 'победитель', 'победила', 'победил', 'победители', 'победителей']
-    prize_keywords = ['2 место', '3 место', 'второе место', 'третье место', 'призер', 'призерка', 'полуфинал', 'финал', 'призеры', 'призеров']
-    participant_keywords = ['участник', 'участница', 'участвовал', 'участвовала', 'участники', 'участников', 'уастник']
-    
-    # Проверяем на победителя
-    if any(keyword.lower() in status for keyword in winner_keywords):
-        return 'Победитель'
-    
-    # Проверяем на призера
-    if any(keyword.lower() in status for keyword in prize_keywords):
-        return 'Призер'
-    
-    # Проверяем на участника
-    if any(keyword.lower() in status for keyword in participant_keywords):
-        return 'Участник'
-    
-    return None
+# Ключевые слова для определения места (в нижнем регистре)
+WINNER_KEYWORDS = ['1 место', 'первое место', 'победитель', 'победила', 'победил', 'победители', 'победителей']
+PRIZE_KEYWORDS = ['2 место', '3 место', 'второе место', 'третье место', 'призер', 'призерка', 'полуфинал', 'финал', 'призеры', 'призеров']
+PARTICIPANT_KEYWORDS = ['участник', 'участница', 'участвовал', 'участвовала', 'участники', 'участников', 'уастник']
 
-def process_students():
-    # Читаем исходный файл
-    df = pd.read_excel('База.xlsx')
-    
-    # Создаем новые DataFrame'ы
-    students_df = pd.DataFrame(columns=[
-        'id', 'ФИО', 'ТЕЛЕФОН', 'РЕГИОН', 'ГОРОД', 
-        'ШКОЛА', 'ДАТА РОЖДЕНИЯ', 'ЭЛ.ПОЧТА', 'ТЕЛЕГРАМ'
-    ])
-    
-    events_df = pd.DataFrame(columns=['id', 'Мероприятие', 'Тип мероприятия', 'Год'])
-    relations_df = pd.DataFrame(columns=['id', 'id_студента', 'id_мероприятия', 'Место'])
-    
-    # Очищаем и стандартизируем данные
+# Места в порядке приоритета: победитель, затем призер, затем участник
+PLACE_PATTERNS = [
+    ('Победитель', re.compile('|'.join(map(re.escape, WINNER_KEYWORDS)))),
+    ('Призер', re.compile('|'.join(map(re.escape, PRIZE_KEYWORDS)))),
+    ('Участник', re.compile('|'.join(map(re.escape, PARTICIPANT_KEYWORDS)))),
+]
+
+def classify_competition_status(statuses):
+    """Определяет место в соревновании сразу для всего столбца статусов"""
+    places = pd.Series([None] * len(statuses), index=statuses.index, dtype=object)
+    status = statuses[statuses.notna()].astype(str).str.lower()
+    
+    matched = pd.Series(False, index=status.index)
+    for place, pattern in PLACE_PATTERNS:
+        hits = status.str.contains(pattern) & ~matched
+        places[hits[hits].index] = place
+        matched |= hits
+    
+    return places
+
+def build_events_and_relations(rows):
+    """Строит таблицы мероприятий и связей по записям с проставленным id_студента"""
+    # Записи со статусом относятся к соревнованиям, без статуса - к курсам
+    is_competition = rows['Статус'].notna() & (rows['Статус'].astype(str).str.strip() != '')
+    rows = rows.assign(**{
+        'Тип мероприятия': is_competition.map({True: 'Соревнование', False: 'Курс'}),
+        'Место': classify_competition_status(rows['Статус']).where(is_competition, None),
+    })
+    
+    # Номер мероприятия - порядковый номер первого появления (название, год, тип)
+    rows['id_мероприятия'] = rows.groupby(
+        ['Мероприятие', 'Год', 'Тип мероприятия'], sort=False, dropna=False
+    ).ngroup() + 1
+    
+    events_df = rows.drop_duplicates('id_мероприятия')[['id_мероприятия', 'Мероприятие', 'Тип мероприятия', 'Год']]
+    events_df = events_df.rename(columns={'id_мероприятия': 'id'}).reset_index(drop=True)
+    
+    # Одна связь на пару студент-мероприятие, место берется из первой записи
+    relations_df = rows.drop_duplicates(['id_студента', 'id_мероприятия'])[['id_студента', 'id_мероприятия', 'Место']]
+    relations_df = relations_df.reset_index(drop=True)
+    relations_df.insert(0, 'id', range(1, len(relations_df) + 1))
+    
+    return events_df, relations_df
+
+def clean_students(df):
+    """Очищает и стандартизирует поля исходной таблицы"""
+    df = df.copy()
     df['ТЕЛЕФОН'] = df['ТЕЛЕФОН'].apply(clean_phone)
     df['ФИО'] = df['ФИО'].apply(clean_fio)
     df['ГОРОД'] = df['ГОРОД'].apply(clean_city)
     df['РЕГИОН'] = df['РЕГИОН'].apply(clean_region)
     df['ДАТА РОЖДЕНИЯ'] = df['ДАТА РОЖДЕНИЯ'].apply(clean_date)
-    
-    # Объединяем похожие названия регионов и городов
-    region_groups = find_similar_names(df['РЕГИОН'].dropna().unique())
-    city_groups = find_similar_names(df['ГОРОД'].dropna().unique())
+    df['ЭЛ.ПОЧТА'] = df['ЭЛ.ПОЧТА'].apply(clean_email)
+    df['ТЕЛЕГРАМ'] = df['ТЕЛЕГРАМ'].apply(clean_telegram)
+    return df
+
+def canonicalize_names(df, threshold=0.8):
+    """Объединяет похожие названия регионов и городов"""
+    df = df.copy()
+    region_groups = find_similar_names(df['РЕГИОН'].dropna().unique(), threshold)
+    city_groups = find_similar_names(df['ГОРОД'].dropna().unique(), threshold)
     
     # Применяем объединение
     for main_region, group in region_groups.items():
@@ -360,6 +498,47 @@ def process_students():
     for main_city, group in city_groups.items():
         df.loc[df['ГОРОД'].isin(group), 'ГОРОД'] = main_city
     
+    return df
+
+def cluster_records(index, fio_groups, field_groups):
+    """Собирает итоговые группы записей: одна группа - один студент"""
+    # Первый проход: дубликаты по ФИО
+    duplicate_groups = list(fio_groups)
+    processed_indices = {idx for group_indices in duplicate_groups for idx in group_indices}
+    
+    # Второй проход: дубликаты по полям среди еще не обработанных записей
+    for group_indices in field_groups:
+        if not any(idx in processed_indices for idx in group_indices):
+            duplicate_groups.append(group_indices)
+            processed_indices.update(group_indices)
+    
+    # Оставшиеся студенты без дубликатов - группы из одной записи
+    return duplicate_groups + [[idx] for idx in index if idx not in processed_indices]
+
+# Код, от которого зависят результаты этапов (для ключей кэша)
+CLEANING_CODE = [clean_phone, clean_fio, clean_city, clean_region, clean_date, clean_email, clean_telegram]
+MATCHING_CODE = [
+    intern_match_keys, *CLEANING_CODE, MATCH_KEY_COLUMNS, split_fio, compare_fio_parts,
+    phonetic_key, PHONETIC_TABLE, name_sort_keys, find_neighbour_pairs, combine_keys, bucket_pairs,
+    find_shared_key_pairs,
+    build_candidates, group_duplicates, count_matching_keys,
+]
+
+def process_students(save_db=True, cache_dir=None, cache_size=DEFAULT_CACHE_SIZE, single_workbook=False,
+                     output_dir='.'):
+    # Промежуточные результаты этапов кэшируются в cache_dir по хэшу входов, параметров и кода
+    def stage(name, func, inputs, params=None, code=()):
+        return cached_stage(cache_dir, name, func, inputs, params, code, max_size=cache_size)
+    
+    # Читаем исходный файл
+    df = stage('raw', pd.read_excel, {'io': Path('База.xlsx')})
+    
+    # Очищаем и стандартизируем данные
+    df = stage('clean', clean_students, {'df': df}, code=CLEANING_CODE)
+    
+    # Объединяем похожие названия регионов и городов
+    df = stage('names', canonicalize_names, {'df': df}, {'threshold': 0.8}, code=[find_similar_names])
+    
     # Заполняем отсутствующие годы текущим годом
     current_year = datetime.now().year
     df['Год'] = df['Год'].fillna(current_year)
@@ -367,182 +546,98 @@ def process_students():
     # Удаляем строки, где нет ни телефона, ни ФИО
     df = df.dropna(subset=['ТЕЛЕФОН', 'ФИО'], how='all')
     
-    # Создаем словарь для хранения мероприятий
-    events_dict = {}
-    event_id = 1
-    
-    # Создаем словарь для хранения связей
-    relations_dict = {}
-    relation_id = 1
+    # Коды полей сравнения общие для обоих проходов
+    match_keys = intern_match_keys(df)
     
-    # Первый проход: находим дубликаты по ФИО
-    duplicate_groups = find_duplicates(df)
-    processed_indices = set()
+    # Находим дубликаты по ФИО и по полям
+    fio_groups = stage('fio_matches', find_duplicates, {'df': df, 'match_keys': match_keys},
+                       {'window': NEIGHBOURHOOD_WINDOW}, code=MATCHING_CODE)
+    field_groups = stage('field_matches', find_duplicates_by_fields, {'df': df, 'match_keys': match_keys},
+                         code=MATCHING_CODE)
+    duplicate_groups = stage('clusters', cluster_records,
+                             {'index': df.index, 'fio_groups': fio_groups, 'field_groups': field_groups})
     
-    # Обрабатываем группы с дубликатами
-    for group_indices in duplicate_groups:
-        group = df.loc[group_indices]
-        merged_row = merge_duplicate_rows(group)
-        
-        # Добавляем студента
-        student_id = len(students_df) + 1
-        students_df.loc[len(students_df)] = {
-            'id': student_id,
-            'ФИО': merged_row['ФИО'],
-            'ТЕЛЕФОН': merged_row['ТЕЛЕФОН'],
-            'РЕГИОН': merged_row['РЕГИОН'],
-            'ГОРОД': merged_row['ГОРОД'],
-            'ШКОЛА': merged_row['ШКОЛА'],
-            'ДАТА РОЖДЕНИЯ': merged_row['ДАТА РОЖДЕНИЯ'],
-            'ЭЛ.ПОЧТА': merged_row['ЭЛ.ПОЧТА'],
-            'ТЕЛЕГРАМ': merged_row['ТЕЛЕГРАМ']
-        }
-        
-        # Обрабатываем мероприятия для этой группы
-        for _, row in group.iterrows():
-            event_type = 'Соревнование' if pd.notna(row['Статус']) and str(row['Статус']).strip() != '' else 'Курс'
-            event_key = (row['Мероприятие'], row['Год'], event_type)
-            
-            # Добавляем мероприятие, если его еще нет
-            if event_key not in events_dict:
-                events_dict[event_key] = event_id
-                events_df.loc[len(events_df)] = {
-                    'id': event_id,
-                    'Мероприятие': row['Мероприятие'],
-                    'Тип мероприятия': event_type,
-                    'Год': row['Год']
-                }
-                event_id += 1
-            
-            # Добавляем связь
-            relation_key = (student_id, events_dict[event_key])
-            if relation_key not in relations_dict:
-                relations_dict[relation_key] = relation_id
-                relations_df.loc[len(relations_df)] = {
-                    'id': relation_id,
-                    'id_студента': student_id,
-                    'id_мероприятия': events_dict[event_key],
-                    'Место': parse_competition_place(row['Статус']) if event_type == 'Соревнование' else None
-                }
-                relation_id += 1
-        
-        processed_indices.update(group_indices)
-    
-    # Второй проход: находим дубликаты по полям
-    duplicate_groups = find_duplicates_by_fields(df)
+    # Объединяем группы: один студент на группу, id - порядковый номер группы
+    students_df = merge_duplicate_groups(df, duplicate_groups)[[
+        'ФИО', 'ТЕЛЕФОН', 'РЕГИОН', 'ГОРОД', 
+        'ШКОЛА', 'ДАТА РОЖДЕНИЯ', 'ЭЛ.ПОЧТА', 'ТЕЛЕГРАМ'
+    ]].reset_index(drop=True)
+    students_df.insert(0, 'id', range(1, len(students_df) + 1))
     
-    # Обрабатываем оставшиеся группы с дубликатами
-    for group_indices in duplicate_groups:
-        if not any(idx in processed_indices for idx in group_indices):
-            group = df.loc[group_indices]
-            merged_row = merge_duplicate_rows(group)
-            
-            # Добавляем студента
-            student_id = len(students_df) + 1
-            students_df.loc[len(students_df)] = {
-                'id': student_id,
-                'ФИО': merged_row['ФИО'],
-                'ТЕЛЕФОН': merged_row['ТЕЛЕФОН'],
-                'РЕГИОН': merged_row['РЕГИОН'],
-                'ГОРОД': merged_row['ГОРОД'],
-                'ШКОЛА': merged_row['ШКОЛА'],
-                'ДАТА РОЖДЕНИЯ': merged_row['ДАТА РОЖДЕНИЯ'],
-                'ЭЛ.ПОЧТА': merged_row['ЭЛ.ПОЧТА'],
-                'ТЕЛЕГРАМ': merged_row['ТЕЛЕГРАМ']
-            }
-            
-            # Обрабатываем мероприятия для этой группы
-            for _, row in group.iterrows():
-                event_type = 'Соревнование' if pd.notna(row['Статус']) and str(row['Статус']).strip() != '' else 'Курс'
-                event_key = (row['Мероприятие'], row['Год'], event_type)
-                
-                # Добавляем мероприятие, если его еще нет
-                if event_key not in events_dict:
-                    events_dict[event_key] = event_id
-                    events_df.loc[len(events_df)] = {
-                        'id': event_id,
-                        'Мероприятие': row['Мероприятие'],
-                        'Тип мероприятия': event_type,
-                        'Год': row['Год']
-                    }
-                    event_id += 1
-                
-                # Добавляем связь
-                relation_key = (student_id, events_dict[event_key])
-                if relation_key not in relations_dict:
-                    relations_dict[relation_key] = relation_id
-                    relations_df.loc[len(relations_df)] = {
-                        'id': relation_id,
-                        'id_студента': student_id,
-                        'id_мероприятия': events_dict[event_key],
-                        'Место': parse_competition_place(row['Статус']) if event_type == 'Соревнование' else None
-                    }
-                    relation_id += 1
-            
-            processed_indices.update(group_indices)
+    # Все записи в порядке групп с номером студента
+    rows = df.loc[[idx for group_indices in duplicate_groups for idx in group_indices]].reset_index(drop=True)
+    rows['id_студента'] = [number + 1 for number, group_indices in enumerate(duplicate_groups) for _ in group_indices]
     
-    # Обрабатываем оставшихся студентов без дубликатов
-    for idx, row in df.iterrows():
-        if idx not in processed_indices:
-            # Добавляем студента
-            student_id = len(students_df) + 1
-            students_df.loc[len(students_df)] = {
-                'id': student_id,
-                'ФИО': row['ФИО'],
-                'ТЕЛЕФОН': row['ТЕЛЕФОН'],
-                'РЕГИОН': row['РЕГИОН'],
-                'ГОРОД': row['ГОРОД'],
-                'ШКОЛА': row['ШКОЛА'],
-                'ДАТА РОЖДЕНИЯ': row['ДАТА РОЖДЕНИЯ'],
-                'ЭЛ.ПОЧТА': row['ЭЛ.ПОЧТА'],
-                'ТЕЛЕГРАМ': row['ТЕЛЕГРАМ']
-            }
-            
-            # Добавляем мероприятие и связь
-            event_type = 'Соревнование' if pd.notna(row['Статус']) and str(row['Статус']).strip() != '' else 'Курс'
-            event_key = (row['Мероприятие'], row['Год'], event_type)
-            
-            if event_key not in events_dict:
-                events_dict[event_key] = event_id
-                events_df.loc[len(events_df)] = {
-                    'id': event_id,
-                    'Мероприятие': row['Мероприятие'],
-                    'Тип мероприятия': event_type,
-                    'Год': row['Год']
-                }
-                event_id += 1
-            
-            relation_key = (student_id, events_dict[event_key])
-            if relation_key not in relations_dict:
-                relations_dict[relation_key] = relation_id
-                relations_df.loc[len(relations_df)] = {
-                    'id': relation_id,
-                    'id_студента': student_id,
-                    'id_мероприятия': events_dict[event_key],
-                    'Место': parse_competition_place(row['Статус']) if event_type == 'Соревнование' else None
-                }
-                relation_id += 1
+    events_df, relations_df = build_events_and_relations(rows)
     
     # Сохраняем результаты
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    
+    if single_workbook:
+        # Все таблицы на листах одной книги
+        files = {'workbook': f'students_data_{timestamp}.xlsx'}
+        export_excel({Path(output_dir) / files['workbook']: {
+            WORKBOOK_SHEETS['students']: students_df,
+            WORKBOOK_SHEETS['events']: events_df,
+            WORKBOOK_SHEETS['relations']: relations_df,
+        }})
+        print(f'Обработка завершена. Результат сохранен в файл: {files["workbook"]}')
+    else:
+        # Три файла записываются параллельно
+        files = {
+            'students': f'students_clean_{timestamp}.xlsx',
+            'events': f'events_clean_{timestamp}.xlsx',
+            'relations': f'student_event_relations_{timestamp}.xlsx',
+        }
+        export_excel({
+            Path(output_dir) / files['students']: {'Sheet1': students_df},
+            Path(output_dir) / files['events']: {'Sheet1': events_df},
+            Path(output_dir) / files['relations']: {'Sheet1': relations_df},
+        })
+        print(f'Обработка студентов завершена. Результат сохранен в файл: {files["students"]}')
+        print(f'Обработка мероприятий завершена. Результат сохранен в файл: {files["events"]}')
+        print(f'Создание связей завершено. Результат сохранен в файл: {files["relations"]}')
     
-    # Сохраняем студентов
-    students_filename = f'students_clean_{timestamp}.xlsx'
-    students_df.to_excel(students_filename, index=False)
-    print(f'Обработка студентов завершена. Результат сохранен в файл: {students_filename}')
     print(f'Всего уникальных студентов: {len(students_df)}')
-    
-    # Сохраняем мероприятия
-    events_filename = f'events_clean_{timestamp}.xlsx'
-    events_df.to_excel(events_filename, index=False)
-    print(f'Обработка мероприятий завершена. Результат сохранен в файл: {events_filename}')
     print(f'Всего уникальных мероприятий: {len(events_df)}')
-    
-    # Сохраняем связи
-    relations_filename = f'student_event_relations_{timestamp}.xlsx'
-    relations_df.to_excel(relations_filename, index=False)
-    print(f'Создание связей завершено. Результат сохранен в файл: {relations_filename}')
     print(f'Всего связей: {len(relations_df)}')
+    
+    # Сохраняем во встроенную базу для дашборда: у каждого запуска своя база,
+    # поэтому дашборд не увидит, как база меняется под уже загруженной версией
+    db_name = None
+    if save_db:
+        db_name = database_name(timestamp)
+        save_to_sqlite(students_df, events_df, relations_df, str(Path(output_dir) / db_name))
+        print(f'Данные сохранены в базу: {db_name}')
+    
+    # Манифест пишется последним: по нему дашборд узнает о завершенном запуске
+    write_manifest(output_dir, {
+        'timestamp': timestamp,
+        'files': files,
+        'db': db_name,
+    })
+    
+    # Базы прежних запусков удаляем, когда их уже давно заменила более новая
+    prune_databases(output_dir, db_name)
 
 if __name__ == '__main__':
-    process_students()
+    parser = argparse.ArgumentParser(description='Очистка и объединение данных о студентах')
+    parser.add_argument('--output-dir', default='.', help='каталог для результатов (data_path дашборда)')
+    parser.add_argument('--no-db', action='store_true',
+                        help='не сохранять базу SQLite для дашборда (students_<метка>.sqlite в --output-dir)')
+    parser.add_argument('--cache-dir', default='.pipeline_cache',
+                        help='каталог кэша промежуточных результатов (по умолчанию .pipeline_cache)')
+    parser.add_argument('--no-cache', action='store_true', help='не использовать кэш промежуточных результатов')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE // 1024 ** 2,
+                        help='предельный размер кэша в МБ')
+    parser.add_argument('--single-workbook', action='store_true',
+                        help='сохранить студентов, мероприятия и связи на листах одной книги')
+    args = parser.parse_args()
+    process_students(
+        save_db=not args.no_db,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        cache_size=args.cache_size * 1024 ** 2,
+        single_workbook=args.single_workbook,
+        output_dir=args.output_dir
+    )
@@ -0,0 +1,91 @@
+import hashlib
+import inspect
+import os
+import pickle
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Размер кэша по умолчанию, после превышения удаляются давно не использованные результаты
+DEFAULT_CACHE_SIZE = 2 * 1024 ** 3
+
+
+def fingerprint(value):
+    """Хэш содержимого: DataFrame, массива, файла или обычного объекта"""
+    digest = hashlib.sha256()
+    if isinstance(value, pd.DataFrame):
+        digest.update(repr([(column, str(dtype)) for column, dtype in value.dtypes.items()]).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+        # Для столбцов object pandas хэширует строковое представление, и 1 не отличается от '1',
+        # поэтому отдельно учитываем тип каждого значения
+        object_columns = value.select_dtypes(include='object')
+        if len(object_columns.columns):
+            value_types = object_columns.map(lambda item: type(item).__name__)
+            digest.update(pd.util.hash_pandas_object(value_types, index=False).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        digest.update(f'{value.dtype}{value.shape}'.encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, Path):
+        with open(value, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+    else:
+        digest.update(pickle.dumps(value))
+    return digest.hexdigest()
+
+
+def code_fingerprint(code):
+    """Хэш исходного кода функций и значений констант, от которых зависит этап"""
+    digest = hashlib.sha256()
+    for item in code:
+        source = inspect.getsource(item) if callable(item) else repr(item)
+        digest.update(source.encode())
+    return digest.hexdigest()
+
+
+def evict(cache_dir, max_size):
+    """Удаляет давно не использованные результаты, пока кэш больше max_size байт"""
+    files = sorted(Path(cache_dir).glob('*.pkl'), key=lambda path: path.stat().st_mtime)
+    total = sum(path.stat().st_size for path in files)
+    for path in files:
+        if total <= max_size:
+            break
+        total -= path.stat().st_size
+        path.unlink()
+
+
+def cached_stage(cache_dir, name, func, inputs, params=None, code=(), max_size=DEFAULT_CACHE_SIZE):
+    """Выполняет этап конвейера func(**inputs, **params) или берет его результат из кэша.
+
+    Ключ результата - хэш содержимого входов, параметров и кода этапа, поэтому
+    этап пересчитывается, только если изменилось что-то, от чего он зависит.
+    Без cache_dir этап просто выполняется."""
+    params = params or {}
+    if cache_dir is None:
+        return func(**inputs, **params)
+
+    key = fingerprint((
+        {input_name: fingerprint(value) for input_name, value in inputs.items()},
+        params,
+        code_fingerprint([func, *code]),
+    ))
+    path = Path(cache_dir) / f'{name}_{key[:32]}.pkl'
+
+    if path.exists():
+        # Отмечаем использование для вытеснения давно не использованных
+        os.utime(path)
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    result = func(**inputs, **params)
+
+    # Пишем во временный файл, чтобы прерванный запуск не оставил испорченный результат
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    evict(cache_dir, max_size)
+
+    return result
@@ -0,0 +1,183 @@
+import os
+import sqlite3
+from contextlib import closing
+
+import pandas as pd
+
+# Индексы по полям, по которым дашборд фильтрует и соединяет таблицы
+INDEXES = {
+    'idx_students_id': ('students', 'id'),
+    'idx_students_region': ('students', 'РЕГИОН'),
+    'idx_students_city': ('students', 'ГОРОД'),
+    'idx_events_id': ('events', 'id'),
+    'idx_events_year': ('events', 'Год'),
+    'idx_relations_student': ('relations', 'id_студента'),
+    'idx_relations_event': ('relations', 'id_мероприятия'),
+}
+
+
+def save_to_sqlite(students_df, events_df, relations_df, db_path):
+    """Сохраняет студентов, мероприятия и связи во встроенную базу SQLite"""
+    # Пишем во временный файл и подменяем базу целиком,
+    # чтобы дашборд никогда не открыл наполовину записанный файл
+    tmp_path = f'{db_path}.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    with closing(sqlite3.connect(tmp_path)) as conn:
+        students_df.to_sql('students', conn, index=False)
+        events_df.to_sql('events', conn, index=False)
+        relations_df.to_sql('relations', conn, index=False)
+
+        for name, (table, column) in INDEXES.items():
+            conn.execute(f'CREATE INDEX {name} ON {table} ("{column}")')
+        conn.commit()
+
+    os.replace(tmp_path, db_path)
+
+
+def connect(db_path):
+    """Открывает базу только на чтение"""
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    # Встроенный LOWER в SQLite не работает с кириллицей
+    conn.create_function('py_lower', 1, lambda value: value.lower() if isinstance(value, str) else value,
+                         deterministic=True)
+    return conn
+
+
+def query(db_path, sql, params=()):
+    """Выполняет запрос и возвращает результат в виде DataFrame"""
+    with closing(connect(db_path)) as conn:
+        return pd.read_sql_query(sql, conn, params=list(params))
+
+
+def in_clause(column, values):
+    """Строит условие IN для фильтра; None означает «без фильтра»"""
+    if values is None:
+        return '1', []
+    if len(values) == 0:
+        return '0', []
+    placeholders = ', '.join('?' * len(values))
+    return f'{column} IN ({placeholders})', list(values)
+
+
+def load_filter_values(db_path):
+    """Возвращает значения для фильтров боковой панели"""
+    years = query(db_path, 'SELECT DISTINCT "Год" FROM events WHERE "Год" IS NOT NULL ORDER BY "Год"')
+    regions = query(db_path, 'SELECT DISTINCT "РЕГИОН" FROM students WHERE "РЕГИОН" IS NOT NULL ORDER BY "РЕГИОН"')
+    cities = query(db_path, 'SELECT DISTINCT "ГОРОД" FROM students WHERE "ГОРОД" IS NOT NULL ORDER BY "ГОРОД"')
+    return years['Год'].tolist(), regions['РЕГИОН'].tolist(), cities['ГОРОД'].tolist()
+
+
+def events_filter(event_type, years, alias='e'):
+    """Условие отбора мероприятий по типу и году"""
+    year_sql, year_params = in_clause(f'{alias}."Год"', years)
+    if event_type == "Все":
+        return year_sql, year_params
+    return f'{alias}."Тип мероприятия" = ? AND {year_sql}', [event_type] + year_params
+
+
+def students_filter(regions, cities, alias='s'):
+    """Условие отбора студентов по региону и городу"""
+    region_sql, region_params = in_clause(f'{alias}."РЕГИОН"', regions)
+    city_sql, city_params = in_clause(f'{alias}."ГОРОД"', cities)
+    return f'{region_sql} AND {city_sql}', region_params + city_params
+
+
+def query_event_participants(db_path, event_type, years):
+    """Количество участников каждого мероприятия с учетом фильтров"""
+    where_sql, params = events_filter(event_type, years)
+    return query(db_path, f'''
+        SELECT e.id AS id_мероприятия, e."Мероприятие", e."Тип мероприятия", e."Год",
+               COUNT(*) AS "Количество участников"
+        FROM relations r
+        JOIN events e ON e.id = r.id_мероприятия
+        WHERE {where_sql}
+        GROUP BY e.id
+    ''', params)
+
+
+def search_students(db_path, search, regions, cities, limit):
+    """Ищет студентов по подстроке в ФИО или телефоне либо по фильтрам"""
+    if search:
+        # Поиск, как и раньше, идет по всем студентам без учета фильтров
+        where_sql = 'instr(py_lower("ФИО"), ?) > 0 OR instr(py_lower("ТЕЛЕФОН"), ?) > 0'
+        params = [search.lower()] * 2
+    else:
+        where_sql, params = students_filter(regions, cities, alias='students')
+    return query(db_path, f'SELECT * FROM students WHERE {where_sql} ORDER BY id LIMIT ?', params + [limit])
+
+
+def query_student_events(db_path, student_id):
+    """Мероприятия одного студента"""
+    return query(db_path, '''
+        SELECT r.*, e."Мероприятие", e."Тип мероприятия", e."Год"
+        FROM relations r
+        JOIN events e ON e.id = r.id_мероприятия
+        WHERE r.id_студента = ?
+    ''', [int(student_id)])
+
+
+# Пары курс-соревнование одного студента, где курс был не позже соревнования
+PAIRS_SQL = '''
+    SELECT s.id AS id_студента, s."ФИО" AS "Студент",
+           c."Мероприятие" AS "Курс", c."Год" AS "Год курса",
+           k."Мероприятие" AS "Соревнование", k."Год" AS "Год соревнования",
+           rk."Место" AS "Место"
+    FROM relations rc
+    JOIN events c ON c.id = rc.id_мероприятия AND c."Тип мероприятия" = 'Курс'
+    JOIN relations rk ON rk.id_студента = rc.id_студента
+    JOIN events k ON k.id = rk.id_мероприятия AND k."Тип мероприятия" = 'Соревнование'
+    JOIN students s ON s.id = rc.id_студента
+    WHERE c."Год" <= k."Год"
+'''
+
+# Подсчет победителей, призеров и участников внутри группы пар
+PLACES_SQL = '''
+    COUNT(*) AS "Количество студентов",
+    SUM(CASE WHEN "Место" = 'Победитель' THEN 1 ELSE 0 END) AS "Победители",
+    SUM(CASE WHEN "Место" = 'Призер' THEN 1 ELSE 0 END) AS "Призеры",
+    SUM(CASE WHEN "Место" = 'Участник' THEN 1 ELSE 0 END) AS "Не заняли места"
+'''
+
+
+def query_pairs_by_year(db_path):
+    """Пары курс-соревнование, сгруппированные по курсу и годам"""
+    return query(db_path, f'''
+        SELECT "Курс", "Год курса", "Год соревнования", {PLACES_SQL}
+        FROM ({PAIRS_SQL})
+        GROUP BY "Курс", "Год курса", "Год соревнования"
+    ''')
+
+
+def query_popular_pairs(db_path):
+    """Статистика мест по парам курс-соревнование"""
+    return query(db_path, f'''
+        SELECT "Курс", "Соревнование", {PLACES_SQL}
+        FROM ({PAIRS_SQL})
+        GROUP BY "Курс", "Соревнование"
+        ORDER BY "Победители" DESC, "Призеры" DESC
+    ''')
+
+
+def query_course_effectiveness(db_path):
+    """Статистика мест по курсам"""
+    return query(db_path, f'''
+        SELECT "Курс", {PLACES_SQL}
+        FROM ({PAIRS_SQL})
+        GROUP BY "Курс"
+    ''')
+
+
+def query_student_activity(db_path, regions, cities):
+    """Годы и типы мероприятий каждого студента с учетом фильтров по студентам"""
+    where_sql, params = students_filter(regions, cities)
+    return query(db_path, f'''
+        SELECT r.id_студента, e."Год", e."Тип мероприятия",
+               MAX(CASE WHEN r."Место" IN ('Победитель', 'Призер') THEN 1 ELSE 0 END) AS "Призер"
+        FROM relations r
+        JOIN events e ON e.id = r.id_мероприятия
+        JOIN students s ON s.id = r.id_студента
+        WHERE e."Год" IS NOT NULL AND {where_sql}
+        GROUP BY r.id_студента, e."Год", e."Тип мероприятия"
+    ''', params)